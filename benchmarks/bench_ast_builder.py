@@ -0,0 +1,132 @@
+"""
+Scaling of AstParser._build_ast on synthetic outlines.
+
+    python benchmarks/bench_ast_builder.py [--sizes 10000,25000,50000,100000] [--indents 40]
+
+For each size the outline mixes a regular 4-space hierarchy with irregular
+indents (up to --indents distinct levels), which is what made the legacy
+builder re-sort a growing table of stale indents on every line. The builder
+is linear when the per-line time stays flat as the size grows. The legacy
+object-per-line algorithm is timed alongside for reference, and the peak
+memory of both trees is reported for the largest size.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.logic.ast_parser import AstParser
+
+
+def make_outline(line_count, distinct_indents, seed=0):
+    rng = random.Random(seed)
+    irregular = list(range(1, distinct_indents * 2, 2))
+    lines = []
+    depth = 0
+    for i in range(line_count):
+        if rng.random() < 0.1:
+            indent = rng.choice(irregular)
+        else:
+            depth = max(0, min(depth + rng.choice((-2, -1, 0, 1, 1)), 12))
+            indent = depth * 4
+        tag = " #KV树-词库" if i % 50 == 0 else ""
+        lines.append(" " * indent + f"- item {i}{tag}")
+    return lines
+
+
+class LegacyNode:
+    """The former per-line AST node object, kept here only as a baseline."""
+    def __init__(self, raw_line, indent, parent=None):
+        self.raw_line = raw_line
+        self.indent = indent
+        self.parent = parent
+        self.children = []
+        self.tag = None
+        self.content = self._parse_content()
+
+    def _parse_content(self):
+        tag_pattern = re.compile(r'^(?P<content>.*?)\s*(?P<tag>#KV树-(?P<lib>[^-]+)(?:-(?P<mode>父与子|不包含父))?)$')
+        match = tag_pattern.search(self.raw_line.strip())
+        if match:
+            gd = match.groupdict()
+            self.tag = {'lib': f"#KV树-{gd['lib']}.md", 'mode': gd['mode']}
+            return gd['content'].lstrip('- ').strip()
+        return self.raw_line.strip().lstrip('- ').strip()
+
+    def add_child(self, node):
+        self.children.append(node)
+        node.parent = self
+
+
+def legacy_build_ast(parser, lines):
+    """The original builder: one object per line, sorts every known indent for each line."""
+    Node = LegacyNode
+    root = Node("root", -1)
+    last_node_at_indent = {-1: root}
+    for line in lines:
+        if not line.strip():
+            continue
+        indent = parser.get_indent(line)
+        parent_indent = -1
+        for i in sorted(last_node_at_indent.keys(), reverse=True):
+            if indent > i:
+                parent_indent = i
+                break
+        parent_node = last_node_at_indent[parent_indent]
+        new_node = Node(line, indent, parent=parent_node)
+        parent_node.add_child(new_node)
+        last_node_at_indent[indent] = new_node
+    return root
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,25000,50000,100000")
+    parser.add_argument("--indents", type=int, default=40, help="distinct irregular indents mixed in")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-legacy", action="store_true", help="skip timing the legacy builder")
+    opts = parser.parse_args()
+
+    ast = AstParser()
+    print(f"{'lines':>8} {'build s':>9} {'us/line':>8} {'legacy s':>9} {'us/line':>8}")
+    for size in (int(s) for s in opts.sizes.split(",")):
+        lines = make_outline(size, opts.indents)
+        t_new = best_of(lambda: ast._build_ast(lines), opts.repeat)
+        row = f"{size:>8} {t_new:>9.3f} {t_new / size * 1e6:>8.2f}"
+        if not opts.no_legacy:
+            t_old = best_of(lambda: legacy_build_ast(ast, lines), opts.repeat)
+            row += f" {t_old:>9.3f} {t_old / size * 1e6:>8.2f}"
+        print(row)
+
+    lines = make_outline(size, opts.indents)
+    print(f"peak memory for {size} lines: compact tree {peak_memory(lambda: ast._build_ast(lines)):.1f} MiB", end="")
+    if not opts.no_legacy:
+        print(f", legacy nodes {peak_memory(lambda: legacy_build_ast(ast, lines)):.1f} MiB", end="")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Thread pool vs process pool parse throughput on a synthetic vault.
+
+    python benchmarks/bench_parse_engine.py [--sizes 50,100,200,400,800,1600] [--lines 200]
+
+Prints the wall time of both engines for each batch size and the smallest
+batch size where processes win, which is what PROCESS_MIN_FILES in
+src/core/parse_engine.py should roughly be set to.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.core.parse_engine import ParseEngine
+from src.core.task_dispatcher import TaskDispatcher
+from src.logic.rule_set import CompiledRuleSet
+
+RULES = {
+    "line_rules": [{"match": r"^\s*id::.*", "replace": ""}, {"match": r"^\s*collapsed::.*", "replace": ""}],
+    "content_rules": [{"match": r"\(\(.*?\)\)", "replace": ""}],
+}
+
+
+def make_note(rng, line_count):
+    lines = ["tags:: [[reading]], notes", "alias:: sample", ""]
+    depth = 0
+    for i in range(line_count):
+        depth = max(0, min(depth + rng.choice((-1, 0, 0, 1)), 6))
+        text = f"item {i} ((6500a1b2-0000)) [[link {i % 17}]]"
+        if i % 40 == 0:
+            text += rng.choice((" #KV树-读书词库", " #KV树-工作-父与子", " #KV树-概念-不包含父"))
+        lines.append("    " * depth + "- " + text)
+        if i % 25 == 0:
+            lines.append("    " * depth + "  id:: 6500a1b2-0000-0000")
+    return "\n".join(lines)
+
+
+def make_vault(root, count, line_count):
+    rng = random.Random(count)
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, f"note_{i}.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(make_note(rng, line_count))
+        paths.append(path)
+    return paths
+
+
+def time_engine(engine, jobs, args, mode):
+    start = time.perf_counter()
+    for _path, _outputs, _fingerprint, error in engine.run(jobs, args, mode=mode):
+        if error is not None:
+            raise error
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="50,100,200,400,800,1600")
+    parser.add_argument("--lines", type=int, default=200, help="outline lines per synthetic note")
+    opts = parser.parse_args()
+    sizes = [int(s) for s in opts.sizes.split(",")]
+
+    engine = ParseEngine(TaskDispatcher._parse_single_file_stateless)
+    args = (CompiledRuleSet.from_rules(RULES),)
+    root = tempfile.mkdtemp(prefix="kvt_bench_")
+    try:
+        paths = make_vault(root, max(sizes), opts.lines)
+        print(f"cpu_count={os.cpu_count()}  lines/file={opts.lines}")
+        print(f"{'files':>7} {'thread s':>10} {'process s':>10} {'speedup':>8}")
+        crossover = None
+        for size in sizes:
+            jobs = [(p, None) for p in paths[:size]]
+            t_thread = time_engine(engine, jobs, args, "thread")
+            t_process = time_engine(engine, jobs, args, "process")
+            speedup = t_thread / t_process if t_process else float("inf")
+            if crossover is None and speedup > 1.0:
+                crossover = size
+            print(f"{size:>7} {t_thread:>10.3f} {t_process:>10.3f} {speedup:>7.2f}x")
+        if crossover is None:
+            print("processes never won (single core or very small notes): keep the thread engine")
+        else:
+            print(f"crossover: process pool wins from ~{crossover} files")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
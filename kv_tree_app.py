@@ -2,6 +2,7 @@ import sys
 import os
 import shutil
 import ctypes
+import multiprocessing
 
 # Ensure we can import from src
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
@@ -30,23 +31,29 @@ def main():
     old_cache = os.path.abspath("parsing_cache.json")
     
     config_path = os.path.join(data_dir, "kv_tree_config.json")
-    cache_path = os.path.join(data_dir, "parsing_cache.json")
+    json_cache_path = os.path.join(data_dir, "parsing_cache.json")
     
     if os.path.exists(old_config) and not os.path.exists(config_path):
         try: shutil.move(old_config, config_path)
         except Exception as e: print(f"Failed to move config: {e}")
         
-    if os.path.exists(old_cache) and not os.path.exists(cache_path):
-        try: shutil.move(old_cache, cache_path)
+    if os.path.exists(old_cache) and not os.path.exists(json_cache_path):
+        try: shutil.move(old_cache, json_cache_path)
         except Exception as e: print(f"Failed to move cache: {e}")
     
     # Initialize Managers
     config_manager = ConfigManager(config_path)
-    cache_manager = CacheManager(cache_path)
     
     # Load Config into memory
     config_data = config_manager.load_config()
     
+    # The SQLite backend migrates an existing parsing_cache.json on first load.
+    # Loading itself is deferred to the worker thread's first cache access.
+    if config_data["advanced_options"].get("cache_backend", "sqlite") == "json":
+        cache_manager = CacheManager(json_cache_path, backend="json")
+    else:
+        cache_manager = CacheManager(os.path.join(data_dir, "parsing_cache.db"), backend="sqlite")
+    
     # Setup App State (SSOT)
     app_state = AppState(config_data)
     
@@ -72,6 +79,9 @@ def main():
             final_config = app_state.get_all_data()
             config_manager.save_config(final_config)
             cache_manager.save_cache()
+        cache_manager.close()
 
 if __name__ == "__main__":
+    # Required for the process-pool parse engine in PyInstaller builds
+    multiprocessing.freeze_support()
     main()
@@ -1,6 +1,8 @@
 import threading
 import copy
 
+from src.logic.rule_set import CompiledRuleSet
+
 # 程序预置的 Logseq 系统属性排除键（精确匹配 + 前缀匹配用 * 结尾标记）
 DEFAULT_LOGSEQ_EXCLUDE_KEYS = [
     # —— 精确匹配 ——
@@ -33,7 +35,8 @@ class AppState:
         config = config or {}
         self._source_files = config.get("source_files", {})
         self._output_path = config.get("output_path", "")
-        self._rules = config.get("rules", "")
+        self._rules = self._normalize_rules(config.get("rules", ""))
+        self._compiled_rules = None
         self._advanced_options = config.get("advanced_options", {})
         self._output_selection = config.get("output_selection", {})
         self._blacklist = set(config.get("blacklist", []))
@@ -76,58 +79,69 @@ class AppState:
             
     def get_rules(self):
         with self._lock:
-            rules_data = self._rules
-            
-            # Migration 1: If string rules exist, convert
-            if isinstance(rules_data, str):
-                m_lines = []
-                m_content = []
-                for line in rules_data.split("\n"):
-                    line = line.strip()
-                    if line:
-                        if r"\(\(" in line or "^" not in line:
-                            m_content.append({"match": line, "replace": ""})
-                        else:
-                            m_lines.append({"match": line, "replace": ""})
-                rules_data = {"line_rules": m_lines, "content_rules": m_content}
-                self._rules = rules_data
-                
-            # Migration 2: If it's a list (from earlier iteration), roll it into line_rules
-            elif isinstance(rules_data, list):
-                rules_data = {"line_rules": rules_data, "content_rules": []}
-                self._rules = rules_data
-                
-            # Migration 3: Ensure dict has required keys and clean legacy strings
-            if isinstance(rules_data, dict):
-                def _clean_rules(rule_list):
-                    cleaned = []
-                    for r in rule_list:
-                        m = r.get("match", "").strip()
-                        repl = r.get("replace", "")
-                        if repl == "__KVT_DROP__":
-                            repl = ""
-                            
-                        if not m or m.startswith(";") or (m.startswith("[") and m.endswith("]")):
-                            continue
-                            
-                        # Strip legacy user prefixes like "替换内容_1 = "
-                        if " = " in m:
-                            prefix, value = m.split(" = ", 1)
-                            if "排除" in prefix or "替换" in prefix:
-                                m = value.strip()
-                            
-                        cleaned.append({"match": m, "replace": repl})
-                    return cleaned
+            return self._rules
 
-                rules_data["line_rules"] = _clean_rules(rules_data.get("line_rules", []))
-                rules_data["content_rules"] = _clean_rules(rules_data.get("content_rules", []))
-                self._rules = rules_data
-                
-            return rules_data
+    def get_compiled_rules(self):
+        """
+        Returns the immutable CompiledRuleSet for the current rules. It is built
+        once per rule change and shared by every file, thread and worker process.
+        """
+        with self._lock:
+            if self._compiled_rules is None:
+                self._compiled_rules = CompiledRuleSet.from_rules(self._rules)
+            return self._compiled_rules
             
     def set_rules(self, rules_dict):
         with self._lock:
-            self._rules = rules_dict
+            self._rules = self._normalize_rules(rules_dict)
+            self._compiled_rules = None
+
+    @staticmethod
+    def _normalize_rules(rules_data):
+        """Runs the legacy rule migrations once, when rules are loaded or replaced."""
+        # Migration 1: If string rules exist, convert
+        if isinstance(rules_data, str):
+            m_lines = []
+            m_content = []
+            for line in rules_data.split("\n"):
+                line = line.strip()
+                if line:
+                    if r"\(\(" in line or "^" not in line:
+                        m_content.append({"match": line, "replace": ""})
+                    else:
+                        m_lines.append({"match": line, "replace": ""})
+            rules_data = {"line_rules": m_lines, "content_rules": m_content}
+            
+        # Migration 2: If it's a list (from earlier iteration), roll it into line_rules
+        elif isinstance(rules_data, list):
+            rules_data = {"line_rules": rules_data, "content_rules": []}
+            
+        # Migration 3: Ensure dict has required keys and clean legacy strings
+        if isinstance(rules_data, dict):
+            def _clean_rules(rule_list):
+                cleaned = []
+                for r in rule_list:
+                    m = r.get("match", "").strip()
+                    repl = r.get("replace", "")
+                    if repl == "__KVT_DROP__":
+                        repl = ""
+                        
+                    if not m or m.startswith(";") or (m.startswith("[") and m.endswith("]")):
+                        continue
+                        
+                    # Strip legacy user prefixes like "替换内容_1 = "
+                    if " = " in m:
+                        prefix, value = m.split(" = ", 1)
+                        if "排除" in prefix or "替换" in prefix:
+                            m = value.strip()
+                        
+                    cleaned.append({"match": m, "replace": repl})
+                return cleaned
+
+            rules_data["line_rules"] = _clean_rules(rules_data.get("line_rules", []))
+            rules_data["content_rules"] = _clean_rules(rules_data.get("content_rules", []))
+            
+        return rules_data
             
     def get_advanced_options(self):
         with self._lock:
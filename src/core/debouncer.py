@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import os
+import time
+
+# Defaults for the "debounce_latency_target" / "debounce_max_delay" advanced options (seconds)
+DEFAULT_LATENCY_TARGET = 0.5
+DEFAULT_MAX_DELAY = 10.0
+# A burst's quiet window is this many times the smoothed gap between its events
+QUIET_GAP_FACTOR = 2.0
+# Weight of the newest gap in the smoothed gap
+GAP_SMOOTHING = 0.5
+
+
+def _stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class _Burst:
+    """Events for one file since it was last flushed."""
+    __slots__ = ("first", "last", "gap", "signature", "deadline")
+
+    def __init__(self, now, signature):
+        self.first = now
+        self.last = now
+        self.gap = None
+        self.signature = signature
+        self.deadline = now
+
+
+class QuiescenceDebouncer:
+    """
+    Per-file debounce for file events. Each file is flushed on its own once
+    it has been quiet for its quiet window and its size and mtime have not
+    changed since its last event, so one note that is written continuously
+    (e.g. by a sync client) no longer holds back every other note.
+
+    A single save waits half the latency target. A file that keeps receiving
+    events waits QUIET_GAP_FACTOR times its smoothed gap between events, so
+    slow, steady writers are not flushed half-written. No file waits longer
+    than max_delay after its first unflushed event.
+
+    Deadlines are kept in a heap, so the worker can sleep exactly until the
+    next one (next_deadline) and only the files that are due are examined.
+    Times are time.monotonic() values. Only used from the worker thread.
+    """
+    def __init__(self, latency_target=DEFAULT_LATENCY_TARGET, max_delay=DEFAULT_MAX_DELAY, metrics=None):
+        self.metrics = metrics
+        self._bursts = {}  # path -> _Burst
+        # (deadline, seq, path); an entry is stale once the burst is gone or was rescheduled
+        self._deadlines = []
+        self._seq = itertools.count()
+        self.configure(latency_target, max_delay)
+
+    def configure(self, latency_target, max_delay):
+        self.latency_target = max(float(latency_target), 0.0)
+        self.max_delay = max(float(max_delay), self.latency_target)
+
+    def __len__(self):
+        return len(self._bursts)
+
+    def _quiet_window(self, burst):
+        window = self.latency_target / 2
+        if burst.gap is not None:
+            window = max(window, burst.gap * QUIET_GAP_FACTOR)
+        return window
+
+    def _schedule(self, path, burst):
+        burst.deadline = min(burst.last + self._quiet_window(burst), burst.first + self.max_delay)
+        heapq.heappush(self._deadlines, (burst.deadline, next(self._seq), path))
+
+    def _is_live(self, entry):
+        burst = self._bursts.get(entry[2])
+        return burst is not None and burst.deadline == entry[0]
+
+    def record(self, path, now=None):
+        now = time.monotonic() if now is None else now
+        burst = self._bursts.get(path)
+        if burst is None:
+            burst = self._bursts[path] = _Burst(now, _stat_signature(path))
+        else:
+            gap = now - burst.last
+            burst.gap = gap if burst.gap is None else GAP_SMOOTHING * gap + (1 - GAP_SMOOTHING) * burst.gap
+            burst.last = now
+            burst.signature = _stat_signature(path)
+        self._schedule(path, burst)
+
+    def next_deadline(self):
+        """Earliest time at which some file may be ready, or None when nothing is pending."""
+        while self._deadlines and not self._is_live(self._deadlines[0]):
+            heapq.heappop(self._deadlines)
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def is_due(self, now=None):
+        """Cheap check without stat calls: whether pop_ready() may return anything."""
+        deadline = self.next_deadline()
+        return deadline is not None and (time.monotonic() if now is None else now) >= deadline
+
+    def pop_ready(self, now=None):
+        """
+        Removes and returns [(path, first_event_time)] for files that are ready.
+        A file whose size or mtime moved without an event since the last one is
+        treated as still being written and gets a new quiet window.
+        """
+        now = time.monotonic() if now is None else now
+        ready = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            entry = heapq.heappop(self._deadlines)
+            if not self._is_live(entry):
+                continue
+            path = entry[2]
+            burst = self._bursts[path]
+            if now - burst.first < self.max_delay:
+                signature = _stat_signature(path)
+                if signature != burst.signature:
+                    burst.signature = signature
+                    burst.last = now
+                    self._schedule(path, burst)
+                    continue
+            elif self.metrics is not None:
+                self.metrics.incr("debounce_forced_flushes")
+            del self._bursts[path]
+            ready.append((path, burst.first))
+        return ready
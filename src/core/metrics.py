@@ -0,0 +1,50 @@
+import collections
+import threading
+
+# Samples kept per observed series; percentiles describe the most recent ones
+MAX_SAMPLES = 1024
+
+class Metrics:
+    """
+    Thread-safe named counters shared by the dispatcher and its workers.
+    Values are cumulative for the lifetime of the process. Timings are kept
+    as bounded sample series and summarised as percentiles.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._samples = {}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def get(self, name, default=0):
+        with self._lock:
+            return self._counters.get(name, default)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def ratio(self, part, rest):
+        """part / (part + rest) of two counters, e.g. the share of parses served from a memo; 0.0 when both are zero."""
+        with self._lock:
+            hits = self._counters.get(part, 0)
+            total = hits + self._counters.get(rest, 0)
+        return hits / total if total else 0.0
+
+    def observe(self, name, value):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = collections.deque(maxlen=MAX_SAMPLES)
+            samples.append(value)
+
+    def percentiles(self, name, points=(50, 90, 99)):
+        """Nearest-rank percentiles of the recent samples, e.g. {50: 0.4, 90: 0.7, 99: 1.2}; {} without samples."""
+        with self._lock:
+            values = sorted(self._samples.get(name, ()))
+        if not values:
+            return {}
+        return {p: values[max(0, -(-len(values) * p // 100) - 1)] for p in points}
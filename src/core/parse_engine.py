@@ -0,0 +1,186 @@
+import concurrent.futures
+import functools
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+# Below this many files, spawning worker processes costs more than the GIL-free
+# parsing saves (see benchmarks/bench_parse_engine.py for the measured crossover).
+PROCESS_MIN_FILES = 300
+# Files per process task: large enough to amortise pickling/IPC, small enough
+# to keep all workers busy until the end of the batch.
+MAX_CHUNK_SIZE = 64
+# Submitted-but-unfinished tasks per worker. Beyond this the job producer is
+# blocked, so a streamed batch never buffers more than a few chunks per worker.
+MAX_PENDING_PER_WORKER = 2
+
+_worker_parse = None
+_worker_args = ()
+_worker_cancel = None
+
+def _init_worker(parse_fn, args, cancel=None):
+    """Process initializer: rules/options are shipped once per worker, not once per file."""
+    global _worker_parse, _worker_args, _worker_cancel
+    _worker_parse = parse_fn
+    _worker_args = args
+    _worker_cancel = cancel
+
+def _parse_jobs(parse_fn, args, jobs, cancel=None):
+    """Parses jobs in order; once cancel is set the remaining files are skipped and not reported."""
+    results = []
+    for path, known_digest in jobs:
+        if cancel is not None and cancel.is_set():
+            break
+        try:
+            outputs, fingerprint = parse_fn(path, *args, known_digest)
+            results.append((path, outputs, fingerprint, None))
+        except Exception as e:
+            results.append((path, None, None, e))
+    return results
+
+def _parse_chunk_in_worker(jobs):
+    return _parse_jobs(_worker_parse, _worker_args, jobs, _worker_cancel)
+
+def _chunks(jobs, size):
+    iterator = iter(jobs)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ParseEngine:
+    """
+    Runs a stateless per-file parse function over many files.
+
+    "thread" mode uses a ThreadPoolExecutor, which is cheap to start but GIL bound.
+    "process" mode uses a spawn-based ProcessPoolExecutor with chunked submission,
+    which scales the regex/AST work across cores. "auto" picks processes only for
+    batches large enough to amortise worker start-up.
+
+    Jobs are consumed lazily and results are reported as soon as each file is
+    done, so the engine can sit in the middle of a pipeline (see
+    TaskDispatcher._execute_initialize) with bounded memory.
+    """
+    MODES = ("auto", "thread", "process")
+
+    def __init__(self, parse_fn, mode="auto", max_workers=None):
+        self.parse_fn = parse_fn
+        self.mode = mode if mode in self.MODES else "auto"
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def resolve_mode(self, job_count, mode=None):
+        mode = mode or self.mode
+        if mode == "auto":
+            if job_count < PROCESS_MIN_FILES or self.max_workers < 2:
+                return "thread"
+            return "process"
+        return mode
+
+    def chunk_size(self, job_count):
+        return max(1, min(MAX_CHUNK_SIZE, job_count // (self.max_workers * 4)))
+
+    def run(self, jobs, args, mode=None):
+        """
+        Parses a list of jobs [(path, known_digest), ...] with extra positional args shared by all files.
+        Returns [(path, outputs, fingerprint, error), ...] in completion order.
+        """
+        results = []
+        if jobs:
+            self.stream(jobs, args, lambda *result: results.append(result),
+                        mode=self.resolve_mode(len(jobs), mode), size_hint=len(jobs))
+        return results
+
+    @staticmethod
+    def new_cancel_event():
+        """An event for stream(cancel=...) that worker processes can see as well as threads."""
+        return multiprocessing.get_context("spawn").Event()
+
+    def stream(self, jobs, args, on_result, mode="thread", size_hint=0, cancel=None):
+        """
+        Parses jobs [(path, extra), ...] taken lazily from any iterable, e.g. a
+        queue fed by an earlier pipeline stage, and calls
+        on_result(path, outputs, fingerprint, error) from a pool thread as soon
+        as each file is done. At most MAX_PENDING_PER_WORKER tasks per worker
+        are in flight: while they are all busy (or on_result blocks), no more
+        jobs are pulled. size_hint is the expected job count, used for the
+        process chunk size. Returns once every job has been reported.
+
+        cancel (from new_cancel_event) stops the batch at file granularity:
+        once it is set no more jobs are pulled and workers skip the rest of
+        their queued chunks, so files not parsed by then are never reported.
+        """
+        jobs = iter(jobs)
+        if cancel is not None:
+            jobs = itertools.takewhile(lambda job: not cancel.is_set(), jobs)
+        if mode == "process":
+            retry = self._stream_processes(jobs, args, on_result, size_hint, cancel)
+            if retry is None:
+                return
+            # e.g. a frozen build without multiprocessing support: finish the batch on threads
+            jobs = itertools.chain(retry, jobs)
+        self._stream_threads(jobs, args, on_result, cancel)
+
+    @staticmethod
+    def _report(future, jobs, on_result, slots):
+        try:
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [(path, None, None, e) for path, _ in jobs]
+            for result in results:
+                on_result(*result)
+        finally:
+            slots.release()
+
+    def _stream_threads(self, jobs, args, on_result, cancel=None):
+        workers = min(32, self.max_workers + 4)
+        slots = threading.Semaphore(workers * MAX_PENDING_PER_WORKER)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for job in jobs:
+                slots.acquire()
+                future = executor.submit(_parse_jobs, self.parse_fn, args, [job], cancel)
+                future.add_done_callback(functools.partial(self._report, jobs=[job], on_result=on_result, slots=slots))
+
+    def _stream_processes(self, jobs, args, on_result, size_hint, cancel=None):
+        """Returns None when every job was reported, or the jobs to retry on threads after the pool broke."""
+        size = self.chunk_size(size_hint)
+        workers = self.max_workers
+        if size_hint:
+            workers = min(workers, -(-size_hint // size))
+        slots = threading.Semaphore(workers * MAX_PENDING_PER_WORKER)
+        broken = []
+
+        def report(future, chunk):
+            if isinstance(future.exception(), BrokenProcessPool):
+                broken.extend(chunk)
+                slots.release()
+            else:
+                self._report(future, chunk, on_result, slots)
+
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.parse_fn, args, cancel),
+            ) as executor:
+                for chunk in _chunks(jobs, size):
+                    slots.acquire()
+                    try:
+                        future = executor.submit(_parse_chunk_in_worker, chunk)
+                    except BrokenProcessPool:
+                        broken.extend(chunk)
+                        slots.release()
+                        break
+                    future.add_done_callback(functools.partial(report, chunk=chunk))
+        except (BrokenProcessPool, OSError) as e:
+            print(f"Process pool unavailable, falling back to threads: {e}")
+            return broken
+        if broken:
+            print("Process pool broke, falling back to threads")
+            return broken
+        return None
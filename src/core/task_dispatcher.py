@@ -1,12 +1,62 @@
+import contextlib
+import functools
 import queue
 import threading
 import os
-import stat
 import time
-import concurrent.futures
+from src.core.debouncer import QuiescenceDebouncer, DEFAULT_LATENCY_TARGET, DEFAULT_MAX_DELAY
+from src.core.metrics import Metrics
+from src.core.parse_engine import ParseEngine
+from src.core.task_scheduler import TaskScheduler
 from src.logic.ast_parser import AstParser
+from src.logic.incremental_parser import IncrementalParser
 from src.logic.logseq_parser import LogseqParser
-from src.utils.file_utils import atomic_write
+from src.logic.rule_set import CompiledRuleSet, RuleChange
+from src.utils.file_utils import commit_files, read_source_bytes, content_digest, decode_text, scan_source_file, iter_source_lines, stat_by_directory
+
+LOGSEQ_MARKER = b"::"
+LOGSEQ_LIBRARY = "Logseq属性键值.md"
+# Files at least this large are parsed line by line instead of being read into memory
+STREAM_MIN_BYTES = 32 * 1024 * 1024
+# Capacity of each queue between the initialize pipeline stages
+PIPELINE_QUEUE_SIZE = 256
+# During initialize, changed outputs are written out at most this often
+OUTPUT_FLUSH_SECONDS = 1.0
+# A library whose commit failed this many times in a row is no longer retried until it changes again
+OUTPUT_RETRY_LIMIT = 3
+# Queued tasks that make a running initialize stop at the next file and hand the worker over
+PREEMPTING_TASKS = ("exit", "initialize", "full_rescan", "clear_cache")
+
+
+class _StageQueue(queue.Queue):
+    """Bounded queue between two initialize pipeline stages; producers close it with a None sentinel."""
+    def __init__(self):
+        super().__init__(maxsize=PIPELINE_QUEUE_SIZE)
+        self.open_producers = None
+
+    def close(self):
+        self.put(None)
+
+    def until_closed(self, producers=1):
+        """Yields items until every producer has closed the queue."""
+        self.open_producers = producers
+        while self.open_producers:
+            item = self.get()
+            if item is None:
+                self.open_producers -= 1
+            else:
+                yield item
+
+    def __iter__(self):
+        return self.until_closed()
+
+    def drain(self):
+        """Discards whatever is still coming so blocked producers can finish (used when a consumer fails)."""
+        if self.open_producers is None:
+            self.open_producers = 1
+        for _ in self.until_closed(self.open_producers):
+            pass
+
 
 class TaskDispatcher:
     def __init__(self, app_state, cache_manager, ui_callbacks):
@@ -17,12 +67,33 @@ class TaskDispatcher:
         self.parser = AstParser()
         self.logseq_parser = None
         
-        self.task_queue = queue.Queue()
         self.worker_thread = None
-        self.dirty_files = set()
-        self.last_dirty_time = 0
-        self.debounce_seconds = 2.0
         self.running = True
+        # Library -> consecutive failed commits (e.g. the file was locked). These are committed on their
+        # own and retried with later writes until OUTPUT_RETRY_LIMIT, then only when they change again
+        self.failed_outputs = {}
+        # Files that could not be read while a rule change checked them: their next parse must not be hash-skipped
+        self.force_reparse = set()
+        # A rule-change scan that yielded: (rules it checked against, paths already checked)
+        self.rule_change_resume = None
+        # hash_skipped_parses: files whose mtime changed but content digest did not
+        # prefilter_checked / prefilter_skipped: parses short-circuited by the raw-bytes marker check
+        # rule_change_checked / rule_change_reparsed: files pre-matched and re-parsed after a rule edit
+        # parse_memo_hits / parse_memo_misses: files served from an identical file's layers vs. actually parsed
+        # tasks_coalesced: queued tasks dropped because an identical or broader task was already pending
+        # initialize_preempted: initialize / rescan runs that yielded to edits or newer work and were re-queued
+        # rule_change_preempted: rule-change scans that yielded the same way and resume where they stopped
+        # debounce_forced_flushes / latency_target_missed: edits flushed by the max delay cap / slower than the target
+        # event_to_output_seconds (samples): first file event to outputs written, see latency_percentiles()
+        # outputs_committed: library files written or removed by the batched output-commit stage
+        self.metrics = Metrics()
+        # Edited files are flushed one by one once their writes settle, not after a global quiet period
+        self.dirty_files = QuiescenceDebouncer(metrics=self.metrics)
+        # Priority queue: file events jump ahead of bulk work, redundant rescans collapse into one
+        self.task_queue = TaskScheduler(metrics=self.metrics)
+        self.parse_engine = ParseEngine(self._parse_source_stateless)
+        # Hot saves of large files only re-parse the top-level blocks that changed
+        self.incremental_parser = IncrementalParser(metrics=self.metrics)
         
     def start(self):
         self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
@@ -36,12 +107,20 @@ class TaskDispatcher:
             
     def put_task(self, task):
         self.task_queue.put(task)
+
+    def queue_depth(self):
+        """Tasks currently waiting for the worker thread."""
+        return self.task_queue.depth()
         
     def _worker_loop(self):
+        # A rescan interrupted in a previous session is still unfinished
+        self.task_queue.set_resuming(bool(self.cache_manager.get_stale_paths()))
         while self.running:
             try:
-                # Wait with timeout to allow checking for debounced actions
-                task = self.task_queue.get(timeout=0.5)
+                # Sleep until a task arrives or the next debounced file is due; with nothing pending
+                # the worker blocks without waking up at all
+                deadline = self.dirty_files.next_deadline()
+                task = self.task_queue.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
                 task_name = task[0]
                 
                 if task_name == "exit": 
@@ -51,169 +130,336 @@ class TaskDispatcher:
                 elif task_name == "scan_folder": 
                     self._execute_scan_folder(task[1])
                 elif task_name == "process_file": 
-                    # Add to dirty set instead of immediate processing
-                    self.dirty_files.add((task[1], task[2])) # (event_type, path)
-                    self.last_dirty_time = time.time()
+                    self._record_file_event(task)
                 elif task_name == "regenerate_output": 
                     self._execute_regenerate_output(task[1])
+                elif task_name == "rewrite_outputs": 
+                    self._execute_rewrite_outputs()
+                elif task_name == "recompose_outputs": 
+                    self._execute_recompose_outputs()
+                elif task_name == "apply_rule_change": 
+                    self._execute_apply_rule_change(task[1])
                 elif task_name == "full_rescan": 
                     self._execute_full_rescan()
                 elif task_name == "clear_cache": 
                     self._execute_clear_cache()
-                
-                self.task_queue.task_done()
             except queue.Empty:
-                # Check dirty files for debounce
-                if self.dirty_files and (time.time() - self.last_dirty_time) >= self.debounce_seconds:
-                    self._process_dirty_batch()
+                pass
             except Exception as e:
                 print(f"Worker thread error: {e}")
+            # Check dirty files for debounce, also between tasks so a stream of bulk work cannot starve edits
+            try:
+                if self.dirty_files.is_due():
+                    ready = self.dirty_files.pop_ready()
+                    if ready:
+                        self._process_dirty_batch(ready)
+            except Exception as e:
+                print(f"Worker thread error: {e}")
+
+    def _record_file_event(self, task):
+        # Add to dirty set instead of immediate processing; the event type does not matter,
+        # a file that no longer exists is handled as deleted when it is flushed
+        adv_opts = self.state.get_advanced_options()
+        self.dirty_files.configure(adv_opts.get("debounce_latency_target", DEFAULT_LATENCY_TARGET),
+                                   adv_opts.get("debounce_max_delay", DEFAULT_MAX_DELAY))
+        self.dirty_files.record(task[2])
+
+    def latency_percentiles(self, points=(50, 90, 99)):
+        """Seconds from a file's first unflushed event to its outputs being written, e.g. {50: 0.31, 90: 0.52, 99: 1.8}."""
+        return self.metrics.percentiles("event_to_output_seconds", points)
+
+    def _should_yield(self, preempting=PREEMPTING_TASKS):
+        """
+        Polled by initialize and rule-change scans between files. File events queued meanwhile are
+        recorded right away; the run yields once their debounced batch is due
+        or a task that supersedes it is waiting.
+        """
+        for task in self.task_queue.take("process_file"):
+            self._record_file_event(task)
+        return self.dirty_files.is_due() or self.task_queue.has_pending(preempting)
                 
-    def _process_dirty_batch(self):
-        batch = list(self.dirty_files)
-        self.dirty_files.clear()
-        
+    def _process_dirty_batch(self, batch):
+        """batch: [(path, first_event_time)] of files whose writes have settled, from the debouncer."""
         self.ui_cb['set_status'](f"后台批量处理 {len(batch)} 个变动...")
         dirty_outputs = set()
         
-        rules = self.state.get_rules()
+        rules = self.state.get_compiled_rules()
         adv_opts = self.state.get_advanced_options()
-        output_path_base = self.state.get_output_path()
         logseq_exclude_keys = self.state.get_logseq_exclude_keys()
         
-        unique_paths = set(path for event_type, path in batch)
+        unique_paths = set(path for path, first_event in batch)
         
         for path in unique_paths:
             is_deleted = not os.path.exists(path)
-            old, new = self._update_cache_for_file(path, deleted=is_deleted,
-                                                    rules=rules, adv_opts=adv_opts,
-                                                    output_path_base=output_path_base,
-                                                    logseq_exclude_keys=logseq_exclude_keys)
-            dirty_outputs.update(old.keys())
-            dirty_outputs.update(new.keys())
+            force = path in self.force_reparse
+            self.force_reparse.discard(path)
+            # Only outputs whose line membership actually changed need to be re-emitted
+            dirty_outputs.update(self._update_cache_for_file(path, deleted=is_deleted,
+                                                             rules=rules, adv_opts=adv_opts,
+                                                             logseq_exclude_keys=logseq_exclude_keys, force=force))
             
-        for out_path in dirty_outputs:
-            self._update_single_output_file(out_path)
+        self._write_outputs(dirty_outputs)
+
+        done = time.monotonic()
+        target = self.dirty_files.latency_target
+        for path, first_event in batch:
+            self.metrics.observe("event_to_output_seconds", done - first_event)
+            if done - first_event > target:
+                self.metrics.incr("latency_target_missed")
             
         self.cache_manager.save_cache()
         self.ui_cb['update_lists']()
-        self.ui_cb['set_status'](f"批量更新完成。")
+        p = self.latency_percentiles()
+        latency = f"（改动到写出耗时 P50 {p[50]:.2f}s / P90 {p[90]:.2f}s / P99 {p[99]:.2f}s）" if p else ""
+        self.ui_cb['set_status'](f"批量更新完成。{latency}")
         
     def _execute_initialize(self):
+        """
+        Pipelined start-up: a stat stage finds files whose mtime differs from
+        the cache, a read stage loads and hashes them, the ParseEngine parses
+        them and this thread merges results into the cache as they arrive.
+        The stages run concurrently and are joined by bounded queues, so memory
+        stays bounded and, on a warm start, changed outputs are written out
+        while the rest of the vault is still being parsed.
+
+        The run is preemptible at file granularity: when edits are due or a
+        superseding task is queued, the stat and read stages stop, files already
+        handed to the engine finish and are merged, outputs and cache are saved,
+        and an initialize is re-queued. Merged files carry their new mtime, so
+        the resumed run only picks up what is left. A run from an empty cache
+        is not preemptible, since its libraries are incomplete until it ends.
+
+        Entries marked stale by a full rescan are parsed again like modified
+        files; the run that finishes them writes out every library.
+        """
         self.ui_cb['set_status']("极速启动：正在多线程校验缓存和解析文件...")
         self.ui_cb['update_progress'](mode='determinate', val=0)
-        
-        # 检查输出路径是否与缓存中的路径一致，如果不一致则强制重建
-        current_output = self.state.get_output_path()
-        cached_paths_list = self.cache_manager.get_all_cached_paths()
-        if cached_paths_list:
-            # 检查第一个缓存条目的输出路径是否包含当前 output_path
-            sample_outputs = self.cache_manager.get_outputs_for_file(cached_paths_list[0])
-            if sample_outputs:
-                sample_key = next(iter(sample_outputs))
-                # 如果当前输出路径为空或者缓存中的路径前缀不匹配，强制清除所有缓存的 mtime 以触发重建
-                if (not current_output or current_output == os.getcwd()) or \
-                   (current_output and not sample_key.startswith(current_output)):
-                    for cp in cached_paths_list:
-                        entry = self.cache_manager.get_entry(cp)
-                        if entry:
-                            entry['mtime'] = 0  # 强制使 mtime 失效，触发重新解析
-                            self.cache_manager.update_entry(cp, 0, entry.get('outputs', {}))
+        coalesced_before = self.metrics.get("tasks_coalesced")
         
         all_source_files = self._get_all_source_files()
-        dirty_outputs = set()
+        source_set = set(all_source_files)
         cached_paths = self.cache_manager.get_all_cached_paths()
+        stale_paths = self.cache_manager.get_stale_paths()
+        # While stale entries remain, a queued full_rescan only resumes this rescan
+        self.task_queue.set_resuming(bool(stale_paths))
         total_files = len(all_source_files)
-        
-        files_to_update = []
-        
-        # 1. Quick initial sync and filter
-        for i, file_path in enumerate(all_source_files):
-            if i % 100 == 0:
-                self.ui_cb['set_status'](f"对比文件时间戳 ({i}/{total_files})...")
-                self.ui_cb['update_progress'](val=(i/total_files*50) if total_files > 0 else 0)
-            
-            if not os.path.exists(file_path): 
-                continue
-            
-            cached_entry = self.cache_manager.get_entry(file_path)
-            current_mtime = os.path.getmtime(file_path)
-            if not cached_entry or cached_entry.get("mtime") != current_mtime:
-                files_to_update.append(file_path)
-                
-        # 2. Parallel Processing
-        if files_to_update:
-            total_updates = len(files_to_update)
-            self.ui_cb['set_status'](f"启用多核并发引擎解析 {total_updates} 个变动文件...")
-            
-            rules = self.state.get_rules()
-            adv_opts = self.state.get_advanced_options()
-            output_path_base = self.state.get_output_path()
-            logseq_exclude_keys = self.state.get_logseq_exclude_keys()
-
-            completed = 0
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                # Map paths to future logic manually to handle cache manager locking
-                tasks = [
-                    executor.submit(
-                        self._parse_single_file_stateless,
-                        path, rules, adv_opts, output_path_base, logseq_exclude_keys
-                    ) for path in files_to_update
-                ]
-                
-                for future in concurrent.futures.as_completed(tasks):
-                    path = files_to_update[tasks.index(future)] # Get original path from task list
-                    try:
-                        new_data = future.result()
-                        # Synchronous cache update
-                        old = self.cache_manager.get_outputs_for_file(path)
-                        self.cache_manager.update_entry(path, os.path.getmtime(path), new_data)
-                        dirty_outputs.update(old.keys())
-                        dirty_outputs.update(new_data.keys())
-                    except Exception as exc:
+
+        rules = self.state.get_compiled_rules()
+        adv_opts = self.state.get_advanced_options()
+        logseq_parser = self._make_logseq_parser(adv_opts, self.state.get_logseq_exclude_keys())
+        # The engine is chosen before the stat stage has finished: files missing from
+        # the cache are what a cold start has to parse, modified ones are usually few
+        expected = len(source_set.difference(cached_paths)) + len(source_set.intersection(stale_paths))
+        engine_mode = self.parse_engine.resolve_mode(expected, adv_opts.get("parse_engine"))
+        mode_label = "多进程" if engine_mode == "process" else "多线程"
+
+        stat_queue, parse_queue, merge_queue = _StageQueue(), _StageQueue(), _StageQueue()
+        # Shared with the parse workers, so a preemption also drops the files they have queued
+        cancel = self.parse_engine.new_cancel_event()
+        stages = [
+            threading.Thread(target=self._stat_stage, args=(all_source_files, stat_queue, cancel), daemon=True),
+            threading.Thread(target=self._read_stage, args=(stat_queue, parse_queue, merge_queue, cancel), daemon=True),
+            threading.Thread(target=self._parse_stage, args=(parse_queue, merge_queue, rules, engine_mode, expected, cancel), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+
+        pending_outputs = set()
+        waiting = {}  # digest -> [(path, fingerprint)]: copies of a file that is still being parsed
+        hash_skipped = 0
+        prefilter_checked = prefilter_skipped = 0
+        memo_hits = 0
+        merged = 0
+        # Early flushes and preemption need a warm cache. Starting from an empty cache (first run,
+        # cleared or recreated cache) the libraries are incomplete until the merge finishes and
+        # must not overwrite the complete files already on disk
+        flush_early = bool(cached_paths)
+        last_flush = time.monotonic()
+        try:
+            # Both the read and the parse stage feed this queue, so it closes after two sentinels
+            for kind, path, fingerprint, payload in merge_queue.until_closed(2):
+                if kind == "touch":
+                    self.cache_manager.touch_entry(path, fingerprint["mtime"])
+                    hash_skipped += 1
+                elif kind == "copy":
+                    layers = self._memo_layers(fingerprint["digest"])
+                    if layers is None:
+                        waiting.setdefault(fingerprint["digest"], []).append((path, fingerprint))
+                    else:
+                        pending_outputs.update(self._store_layers(path, layers, fingerprint, logseq_parser))
+                        memo_hits += 1
+                else:
+                    layers, exc = payload
+                    if exc is not None:
                         print(f'{path} generated an exception: {exc}')
-                    
-                    completed += 1
-                    if completed % 50 == 0 or completed == total_updates:
-                        self.ui_cb['set_status'](f"深度多核解析中 ({completed}/{total_updates})...")
-                        self.ui_cb['update_progress'](val=50 + (completed/total_updates*40))
-        
-        self.ui_cb['set_status']("正在清理失效缓存...")
-        for file_path in cached_paths:
-            if file_path not in all_source_files:
-                old = self.cache_manager.get_outputs_for_file(file_path)
-                self.cache_manager.remove_entry(file_path)
-                dirty_outputs.update(old.keys())
-
-        if dirty_outputs:
-            total_outputs = len(dirty_outputs)
-            for i, out_path in enumerate(dirty_outputs):
-                self.ui_cb['set_status'](f"更新输出({i+1}/{total_outputs}): {os.path.basename(out_path)}")
-                self.ui_cb['update_progress'](val=(i+1)/total_outputs*100)
-                self._update_single_output_file(out_path)
+                    elif layers is None:
+                        self.cache_manager.touch_entry(path, fingerprint["mtime"])
+                        hash_skipped += 1
+                    else:
+                        if kind == "reuse":
+                            memo_hits += 1
+                        else:
+                            prefilter_checked += 1
+                            prefilter_skipped += fingerprint.get("prefiltered", False)
+                        pending_outputs.update(self._store_layers(path, layers, fingerprint, logseq_parser))
+                        for copy_path, copy_fingerprint in waiting.pop(fingerprint["digest"], ()):
+                            pending_outputs.update(self._store_layers(copy_path, layers, copy_fingerprint, logseq_parser))
+                            memo_hits += 1
+
+                merged += 1
+                if merged % 50 == 0:
+                    self.ui_cb['set_status'](f"深度{mode_label}解析中（已合并 {merged} 个变动文件）...")
+                    self.ui_cb['update_progress'](val=min(merged / total_files * 90, 90))
+                # First outputs appear while the rest of the vault is still being parsed
+                if flush_early and pending_outputs and time.monotonic() - last_flush >= OUTPUT_FLUSH_SECONDS:
+                    self._write_outputs(pending_outputs)
+                    pending_outputs.clear()
+                    last_flush = time.monotonic()
+                # Stop feeding new files; whatever is already being parsed is still merged and kept
+                if flush_early and not cancel.is_set() and self._should_yield():
+                    cancel.set()
+        finally:
+            # Unblock the producers if merging failed half-way
+            merge_queue.drain()
+            for stage in stages:
+                stage.join()
+
+        preempted = cancel.is_set()
+        if not preempted:
+            for copies in waiting.values():
+                # The first copy failed to parse: parse the others on their own
+                for path, _ in copies:
+                    pending_outputs.update(self._update_cache_for_file(path, rules=rules, adv_opts=adv_opts))
+
+            self.ui_cb['set_status']("正在清理失效缓存...")
+            for file_path in cached_paths:
+                if file_path not in source_set:
+                    pending_outputs.update(self.cache_manager.remove_entry(file_path))
+
+            if stale_paths:
+                # The rescan is complete: files that still could not be parsed lose their old results,
+                # and every library is written, e.g. into an output folder chosen meanwhile
+                for file_path in self.cache_manager.get_stale_paths():
+                    pending_outputs.update(self.cache_manager.remove_entry(file_path))
+                pending_outputs.update(self.cache_manager.get_all_library_names())
+            self.task_queue.set_resuming(False)
+
+        if pending_outputs:
+            self.ui_cb['set_status'](f"正在写出 {len(pending_outputs)} 个词库...")
+            self._write_outputs(pending_outputs)
         
-        # update active outputs state — 根据当前 output_path 过滤
-        outputs_map = {}
-        current_out = self.state.get_output_path()
-        virtual_prefix = "<仅缓存,未设输出目录>"
-        for src in self.cache_manager.get_all_cached_paths():
-            for p in self.cache_manager.get_outputs_for_file(src):
-                basename = os.path.basename(p)
-                if not current_out or current_out == os.getcwd():
-                    # 输出路径未设置，使用虚拟前缀展示
-                    outputs_map[os.path.join(virtual_prefix, basename)] = "多元"
-                elif p.startswith(current_out):
-                    outputs_map[p] = "多元"
-                else:
-                    # 路径与当前输出不匹配，用当前路径重建显示
-                    outputs_map[os.path.join(current_out, basename)] = "多元"
-        self.state.set_active_outputs(outputs_map)
+        # Outputs are cached by library name; resolve them against the current output folder
+        self._refresh_active_outputs()
         
+        self.metrics.incr("hash_skipped_parses", hash_skipped)
+        self.metrics.incr("prefilter_checked", prefilter_checked)
+        self.metrics.incr("prefilter_skipped", prefilter_skipped)
+        self.metrics.incr("parse_memo_hits", memo_hits)
+        self.metrics.incr("parse_memo_misses", prefilter_checked)
         self.cache_manager.save_cache()
         self.ui_cb['update_lists']()
-        self.ui_cb['set_status']("准备就绪。")
+        if preempted:
+            # Copies still waiting for their first file are simply picked up again by the resumed run
+            self.metrics.incr("initialize_preempted")
+            self.put_task(("initialize",))
+            self.ui_cb['set_status'](f"已暂停后台解析（已保存 {merged} 个文件的结果），优先处理新的改动...")
+            self.ui_cb['update_progress'](val=0)
+            return
+        notes = []
+        if prefilter_checked:
+            notes.append(f"预筛命中 {prefilter_skipped}/{prefilter_checked} 个无标签文件")
+        if hash_skipped:
+            notes.append(f"{hash_skipped} 个文件仅时间戳变化、内容未变，已跳过解析")
+        if memo_hits:
+            notes.append(f"{memo_hits} 个重复文件复用了相同内容的解析结果，累计复用率 {self.dedup_ratio():.0%}")
+        coalesced = self.metrics.get("tasks_coalesced") - coalesced_before
+        if coalesced:
+            notes.append(f"期间合并了 {coalesced} 个重复的排队任务")
+        depth = self.queue_depth()
+        if depth:
+            notes.append(f"还有 {depth} 个任务在排队")
+        self.ui_cb['set_status']("准备就绪。" + (f"（{'；'.join(notes)}）" if notes else ""))
         self.ui_cb['update_progress'](val=0)
 
+    def _stat_stage(self, paths, out_queue, cancel):
+        """Initialize stage 1: passes on (path, size, known_digest) for files whose mtime differs from the cache."""
+        try:
+            # One directory listing per folder, folders in parallel, instead of a stat call per file
+            for path, st in stat_by_directory(paths):
+                if cancel.is_set():
+                    break
+                cached_entry = self.cache_manager.get_entry(path)
+                if cached_entry and cached_entry.get("mtime") == st.st_mtime:
+                    continue
+                # Same size as cached: the digest may prove the content is unchanged
+                # (entries cached before the Logseq layer existed are always parsed again)
+                known_digest = None
+                if cached_entry and cached_entry.get("digest") and cached_entry.get("size") == st.st_size and "logseq" in cached_entry:
+                    known_digest = cached_entry["digest"]
+                out_queue.put((path, st.st_size, known_digest))
+        except Exception as e:
+            print(f"Initialize stat stage error: {e}")
+        finally:
+            out_queue.close()
+
+    def _read_stage(self, in_queue, parse_queue, merge_queue, cancel):
+        """
+        Initialize stage 2: reads and hashes each changed file once. Unchanged
+        content only needs its mtime touched, content cached for another file
+        reuses that file's layers (parse memo), and copies of a file that is
+        still being parsed wait for it in the merge stage; only the rest goes
+        on to the parse stage, together with the bytes already read.
+        """
+        in_flight = set()
+        try:
+            for path, size, known_digest in in_queue:
+                if cancel.is_set():
+                    # Let the stat stage see the cancel instead of blocking on a full queue
+                    in_queue.drain()
+                    break
+                if size >= STREAM_MIN_BYTES:
+                    parse_queue.put((path, (None, known_digest)))
+                    continue
+                try:
+                    data, st = read_source_bytes(path)
+                except OSError as e:
+                    print(f"Error reading {path}: {e}")
+                    continue
+                digest = content_digest(data)
+                fingerprint = {"mtime": st.st_mtime, "size": st.st_size, "digest": digest}
+                if digest == known_digest:
+                    merge_queue.put(("touch", path, fingerprint, None))
+                    continue
+                layers = self._memo_layers(digest)
+                if layers is not None:
+                    merge_queue.put(("reuse", path, fingerprint, (layers, None)))
+                elif digest in in_flight:
+                    merge_queue.put(("copy", path, fingerprint, None))
+                else:
+                    in_flight.add(digest)
+                    parse_queue.put((path, (data, fingerprint)))
+        except Exception as e:
+            print(f"Initialize read stage error: {e}")
+            in_queue.drain()
+        finally:
+            parse_queue.close()
+            merge_queue.close()
+
+    def _parse_stage(self, in_queue, merge_queue, rules, mode, expected, cancel):
+        """Initialize stage 3: the ParseEngine pulls jobs as workers free up and reports each file to the merge stage."""
+        def report(path, layers, fingerprint, exc):
+            merge_queue.put(("parsed", path, fingerprint, (layers, exc)))
+        try:
+            # Once cancelled, files not parsed yet are left for the resumed run
+            # Parsing no longer depends on the scan options: they are applied when composing outputs
+            self.parse_engine.stream(in_queue, (rules,), report, mode=mode, size_hint=expected, cancel=cancel)
+            in_queue.drain()
+        except Exception as e:
+            print(f"Initialize parse stage error: {e}")
+            in_queue.drain()
+        finally:
+            merge_queue.close()
+
     def _execute_scan_folder(self, folder_path):
         self.ui_cb['set_status'](f"正在后台扫描: {folder_path}...")
         self.ui_cb['update_progress'](mode='determinate', val=0)
@@ -247,120 +493,483 @@ class TaskDispatcher:
         self.ui_cb['folder_scanned'](folder_path, scanned_files)
 
     def _execute_regenerate_output(self, output_path):
-        self.ui_cb['set_status'](f"后台更新: {os.path.basename(output_path)}...")
-        self._update_single_output_file(output_path)
+        # The UI hands over the displayed path; the cache only knows the library name
+        lib = os.path.basename(output_path)
+        self.ui_cb['set_status'](f"后台更新: {lib}...")
+        self._update_single_output_file(lib)
         self.ui_cb['update_lists']()
-        self.ui_cb['set_status'](f"'{os.path.basename(output_path)}' 更新完成。")
+        self.ui_cb['set_status'](f"'{lib}' 更新完成。")
 
-    def _execute_full_rescan(self):
-        self.ui_cb['set_status']("开始全量重建...")
-        self.cache_manager.cache_data.clear()
+    def _execute_rewrite_outputs(self):
+        """Re-emits every cached library into the (possibly new) output folder without reparsing."""
+        self.ui_cb['set_status']("输出目录已变更，正在写出全部词库...")
+        self.ui_cb['update_progress'](mode='determinate', val=0)
         self.state.clear_active_outputs()
+        libs = self.cache_manager.get_all_library_names()
+        self.ui_cb['set_status'](f"正在写出 {len(libs)} 个词库...")
+        self._write_outputs(libs)
+        self._refresh_active_outputs()
         self.ui_cb['update_lists']()
+        self.ui_cb['set_status']("准备就绪。")
+        self.ui_cb['update_progress'](val=0)
+
+    def _refresh_active_outputs(self):
+        outputs_map = {}
+        current_out = self.state.get_output_path()
+        for lib in self.cache_manager.get_all_library_names():
+            outputs_map[self._resolve_output_path(lib, current_out)] = "多元"
+        self.state.set_active_outputs(outputs_map)
+
+    @staticmethod
+    def _resolve_output_path(lib, base_dest):
+        if not base_dest or base_dest == os.getcwd():
+            # 输出路径未设置，使用虚拟前缀展示
+            return os.path.join("<仅缓存,未设输出目录>", lib)
+        return os.path.join(base_dest, lib)
+
+    def _execute_full_rescan(self):
+        """
+        Re-parses every file without emptying the cache first: entries are
+        marked stale and replaced one by one as initialize parses them, so the
+        libraries stay complete and edits made meanwhile are written at once.
+        The marks are saved with the cache, so a rescan interrupted by new
+        work or by quitting resumes (also on the next start) instead of
+        starting over.
+        """
+        if self.cache_manager.get_stale_paths():
+            self.ui_cb['set_status']("继续全量重建...")
+        else:
+            self.ui_cb['set_status']("开始全量重建...")
+            self.cache_manager.mark_all_stale()
+            self.cache_manager.save_cache()
+            self.rule_change_resume = None
         self._execute_initialize()
         
     def _execute_clear_cache(self):
         self.ui_cb['set_status']("正在清除缓存...")
         try:
-            if os.path.exists(self.cache_manager.cache_file):
-                os.remove(self.cache_manager.cache_file)
-            self.cache_manager.cache_data.clear()
+            libs = self.cache_manager.get_all_library_names()
+            self.cache_manager.wipe()
+            self.rule_change_resume = None
+            self.incremental_parser.clear()
             self.state.clear_active_outputs()
             self.ui_cb['update_lists']()
             self.ui_cb['set_status']("缓存已清除，正在强制重建...")
+            # Runs from the empty cache to completion; libraries no file produces any more are emptied too
             self._execute_initialize()
+            self._write_outputs(set(libs).difference(self.cache_manager.get_all_library_names()))
         except Exception as e:
             self.ui_cb['show_error']("清除缓存失败", str(e))
 
-    def _update_cache_for_file(self, path, deleted=False, rules=None, adv_opts=None, output_path_base=None, logseq_exclude_keys=None):
-        old = self.cache_manager.get_outputs_for_file(path)
-        new = {}
-        if deleted: self.cache_manager.remove_entry(path)
+    def _update_cache_for_file(self, path, deleted=False, rules=None, adv_opts=None, logseq_exclude_keys=None, force=False):
+        """Re-parses one file and returns the outputs whose membership changed. force parses even if the content is unchanged."""
+        if deleted:
+            self.incremental_parser.discard(path)
+            return self.cache_manager.remove_entry(path)
         else:
-            if not os.path.exists(path): return old, new
+            if not os.path.exists(path): return set()
             
             # If rules/options are not provided, fetch them from state (for non-batch updates)
-            if rules is None: rules = self.state.get_rules()
+            if rules is None: rules = self.state.get_compiled_rules()
             if adv_opts is None: adv_opts = self.state.get_advanced_options()
-            if output_path_base is None: output_path_base = self.state.get_output_path()
             if logseq_exclude_keys is None: logseq_exclude_keys = self.state.get_logseq_exclude_keys()
 
-            new = self._parse_single_file_stateless(path, rules, adv_opts, output_path_base, logseq_exclude_keys)
-            self.cache_manager.update_entry(path, os.path.getmtime(path), new)
-        return old, new
+            entry = self.cache_manager.get_entry(path)
+            # Entries written before the Logseq layer was cached must be parsed again
+            known_digest = entry.get("digest") if entry and "logseq" in entry and not force else None
+            try:
+                layers, fingerprint = self._parse_single_file_stateless(path, rules, known_digest,
+                                                                        ast_parse=functools.partial(self.incremental_parser.parse, path),
+                                                                        reuse=None if force else self._memo_layers)
+            except OSError as e:
+                print(f"Error reading {path}: {e}")
+                if force:
+                    # Still has to be parsed under the current rules once it can be read
+                    self.force_reparse.add(path)
+                return set()
+            if layers is None:
+                # Only the mtime was touched (sync tools, git checkout...): no parse needed
+                self.cache_manager.touch_entry(path, fingerprint["mtime"])
+                self.metrics.incr("hash_skipped_parses")
+                return set()
+            if fingerprint.get("reused"):
+                self.metrics.incr("parse_memo_hits")
+            else:
+                self.metrics.incr("parse_memo_misses")
+                self.metrics.incr("prefilter_checked")
+                self.metrics.incr("prefilter_skipped", fingerprint.get("prefiltered", False))
+            return self._store_layers(path, layers, fingerprint, self._make_logseq_parser(adv_opts, logseq_exclude_keys))
+
+    def _store_layers(self, path, layers, fingerprint, logseq_parser):
+        """Composes outputs from freshly parsed layers and caches both; returns the changed outputs."""
+        outputs = self._compose_outputs(layers["ast"], layers["logseq"], logseq_parser)
+        return self.cache_manager.update_entry(path, fingerprint["mtime"], outputs,
+                                               size=fingerprint["size"], digest=fingerprint["digest"],
+                                               logseq_layer=layers["logseq"])
+
+    def _memo_layers(self, digest):
+        """
+        Parse memo: the layers of an already cached file with the same content
+        digest, or None. Cached entries always reflect the current rules (rule
+        edits re-parse the files they affect) and layers no longer depend on
+        the scan options, so the digest alone is the memo key.
+        """
+        entry = self.cache_manager.find_entry_by_digest(digest)
+        if entry is None: return None
+        ast_outputs = {lib: content for lib, content in entry["outputs"].items() if lib != LOGSEQ_LIBRARY}
+        return {"ast": ast_outputs, "logseq": entry["logseq"]}
+
+    def dedup_ratio(self):
+        """Share of file parses answered from the parse memo instead of being parsed again."""
+        return self.metrics.ratio("parse_memo_hits", "parse_memo_misses")
+
+    @staticmethod
+    def _parse_single_file_stateless(file_path: str, rules: CompiledRuleSet, known_digest: str = None, ast_parse=None, reuse=None) -> tuple:
+        """
+        Pure function for parsing a single file. Safe to run in a thread pool
+        or in a worker process (see ParseEngine).
+        Returns (layers, fingerprint). layers holds two independently cached
+        results: "ast" maps library file names (not destination paths) to the
+        joined KV-tag entries, and "logseq" is the raw property layer from
+        LogseqParser.extract_properties, which does not depend on the scan
+        options or exclude keys (see _compose_outputs). fingerprint holds
+        mtime/size/digest.
+        layers is None when the content digest equals known_digest, i.e. the
+        file was only touched and does not need to be parsed again.
+        Files whose raw bytes contain neither a KV tag marker nor a '::' are
+        answered with empty layers without being decoded or parsed;
+        fingerprint["prefiltered"] reports that.
+        ast_parse(content, rules) replaces a fresh AstParser().parse, e.g. with
+        the dispatcher's incremental parser for single-file updates.
+        reuse(digest) may return the layers of another file with the same
+        content (the dispatcher's parse memo); they are returned as is and
+        fingerprint["reused"] is set.
+        """
+        if os.stat(file_path).st_size >= STREAM_MIN_BYTES:
+            streamed = TaskDispatcher._parse_streaming(file_path, rules, known_digest, reuse)
+            if streamed is not None:
+                return streamed
+            # Stale-indent attachments need the whole tree: fall back to the in-memory parse
+
+        data, st = read_source_bytes(file_path)
+        fingerprint = {"mtime": st.st_mtime, "size": st.st_size, "digest": content_digest(data)}
+        if known_digest is not None and fingerprint["digest"] == known_digest:
+            return None, fingerprint
+        reused = reuse(fingerprint["digest"]) if reuse is not None else None
+        if reused is not None:
+            fingerprint["reused"] = True
+            return reused, fingerprint
+        return TaskDispatcher._parse_bytes(file_path, data, rules, fingerprint, ast_parse), fingerprint
 
     @staticmethod
-    def _parse_single_file_stateless(file_path: str, rules: list, adv_opts: dict, output_path_base: str, logseq_exclude_keys: set) -> dict:
+    def _parse_source_stateless(file_path: str, rules: CompiledRuleSet, source: tuple) -> tuple:
         """
-        Pure function for parsing a single file. Safe to run in a thread pool.
+        ParseEngine entry point of the initialize pipeline. source is
+        (data, fingerprint) for a file the read stage already loaded and
+        hashed, so it is not read twice, or (None, known_digest) for a file
+        large enough to be streamed. Same return value as
+        _parse_single_file_stateless.
         """
-        outputs = {}
+        data, info = source
+        if data is None:
+            return TaskDispatcher._parse_single_file_stateless(file_path, rules, info)
+        return TaskDispatcher._parse_bytes(file_path, data, rules, info, None), info
+
+    @staticmethod
+    def _parse_bytes(file_path, data, rules, fingerprint, ast_parse):
+        """Parses the raw bytes of one file into its layers; sets fingerprint["prefiltered"] when the marker check skips it."""
+        layers = {"ast": {}, "logseq": {}}
+        tag_marker = rules.tag_marker
+        if tag_marker is not None and tag_marker not in data and LOGSEQ_MARKER not in data:
+            fingerprint["prefiltered"] = True
+            return layers
+        
         try:
-            with open(file_path, "r", encoding="utf-8") as f: content = f.read()
+            content = decode_text(data)
             # Instantiate fresh parsers to avoid thread state corruption
-            parser = AstParser()
-            res, _ = parser.parse(content, rules=rules)
+            if ast_parse is None: ast_parse = AstParser().parse
+            res, _ = ast_parse(content, rules=rules)
             
-            for lib, entries in res.items(): outputs[os.path.join(output_path_base, lib)] = "\n".join(entries)
+            for lib, entries in res.items(): layers["ast"][lib] = "\n".join(entries)
             
-            if adv_opts.get("logseq_scan_keys") or adv_opts.get("logseq_scan_values") or adv_opts.get("logseq_scan_pure_values"):
-                logseq_parser = LogseqParser(
-                    scan_keys=adv_opts.get("logseq_scan_keys", False),
-                    scan_values=adv_opts.get("logseq_scan_values", False),
-                    scan_pure_values=adv_opts.get("logseq_scan_pure_values", False),
-                    exclude_keys=logseq_exclude_keys
-                )
-                logseq_res = logseq_parser.parse_file_content(content)
-                if logseq_res:
-                    out_path = os.path.join(output_path_base, "Logseq属性键值.md")
-                    existing = set(outputs.get(out_path, "").splitlines()); existing.update(logseq_res)
-                    outputs[out_path] = "\n".join(sorted(list(existing)))
+            layers["logseq"] = LogseqParser.extract_properties(content)
         except Exception as e: print(f"Error parsing {file_path}: {e}")
-        return outputs
+        return layers
+
+    @staticmethod
+    def _parse_streaming(file_path: str, rules: CompiledRuleSet, known_digest: str = None, reuse=None):
+        """
+        Variant of _parse_single_file_stateless for very large files. Digest
+        and prefilter markers come from one chunked read, then a second read
+        feeds the AST and Logseq parsers line by line, so memory is bounded by
+        outline depth and output size instead of file size.
+        Returns None (instead of the usual tuple) when the outline has
+        stale-indent attachments, which only the full in-memory tree can place.
+        """
+        tag_marker = rules.tag_marker
+        markers = [LOGSEQ_MARKER] if tag_marker is None else [tag_marker, LOGSEQ_MARKER]
+        digest, found, st = scan_source_file(file_path, markers)
+        fingerprint = {"mtime": st.st_mtime, "size": st.st_size, "digest": digest}
+        if known_digest is not None and digest == known_digest:
+            return None, fingerprint
+        reused = reuse(digest) if reuse is not None else None
+        if reused is not None:
+            fingerprint["reused"] = True
+            return reused, fingerprint
+
+        layers = {"ast": {}, "logseq": {}}
+        if tag_marker is not None and not found:
+            fingerprint["prefiltered"] = True
+            return layers, fingerprint
 
-    def _update_single_output_file(self, output_path):
-        all_lines = set()
-        for src in self.cache_manager.get_all_cached_paths():
-            outputs = self.cache_manager.get_outputs_for_file(src)
-            if output_path in outputs and outputs[output_path]: all_lines.update(outputs[output_path].splitlines())
-        
-        full_content = "\n".join(sorted(list(all_lines)))
         try:
-            basename = os.path.basename(output_path)
-            
-            # Skip export if the output path is not set (empty or fallback CWD)
-            base_dest = self.state.get_output_path()
-            if not base_dest or base_dest == os.getcwd():
-                self.state.add_active_output(os.path.join("<仅缓存,未设输出目录>", basename), "多元")
-                return
-                
+            logseq_layer = {}
+            with contextlib.closing(iter_source_lines(file_path)) as source:
+                parsed = AstParser().parse_stream(LogseqParser.tap_lines(source, logseq_layer), rules=rules)
+            if parsed is None:
+                return None
+            for lib, entries in parsed[0].items(): layers["ast"][lib] = "\n".join(entries)
+            layers["logseq"] = LogseqParser.finish_layer(logseq_layer)
+        except Exception as e: print(f"Error parsing {file_path}: {e}")
+        return layers, fingerprint
+
+    @staticmethod
+    def _make_logseq_parser(adv_opts, logseq_exclude_keys):
+        """Returns the parser that composes the Logseq library, or None when no scan option is on."""
+        scan_keys = adv_opts.get("logseq_scan_keys", False)
+        scan_values = adv_opts.get("logseq_scan_values", False)
+        scan_pure_values = adv_opts.get("logseq_scan_pure_values", False)
+        if not (scan_keys or scan_values or scan_pure_values):
+            return None
+        return LogseqParser(scan_keys=scan_keys, scan_values=scan_values,
+                            scan_pure_values=scan_pure_values, exclude_keys=logseq_exclude_keys)
+
+    @staticmethod
+    def _compose_outputs(ast_outputs, logseq_layer, logseq_parser):
+        """
+        Combines the cached layers of one file into its outputs under the
+        current scan options and exclude keys. KV-tag libraries never share a
+        name with the Logseq library, so the AST layer is simply the outputs
+        minus LOGSEQ_LIBRARY and does not have to be stored twice.
+        """
+        outputs = dict(ast_outputs)
+        if logseq_parser is not None and logseq_layer:
+            entries = logseq_parser.compose(logseq_layer)
+            if entries:
+                outputs[LOGSEQ_LIBRARY] = "\n".join(entries)
+        return outputs
+
+    def _execute_recompose_outputs(self):
+        """Scan options or exclude keys changed: recompose every file's outputs from its cached layers without reading any source."""
+        self.ui_cb['set_status']("扫描选项已变更，正在从缓存重新组合词库...")
+        adv_opts = self.state.get_advanced_options()
+        logseq_exclude_keys = self.state.get_logseq_exclude_keys()
+        logseq_parser = self._make_logseq_parser(adv_opts, logseq_exclude_keys)
+        dirty_outputs = set()
+        legacy_paths = []
+        for path in self.cache_manager.get_all_cached_paths():
+            entry = self.cache_manager.get_entry(path)
+            if entry is None: continue
+            layer = entry.get("logseq")
+            if layer is None:
+                legacy_paths.append(path)
+                continue
+            old_outputs = entry.get("outputs", {})
+            ast_outputs = {lib: content for lib, content in old_outputs.items() if lib != LOGSEQ_LIBRARY}
+            outputs = self._compose_outputs(ast_outputs, layer, logseq_parser)
+            if outputs != old_outputs:
+                dirty_outputs.update(self.cache_manager.update_entry(path, entry.get("mtime"), outputs,
+                                                                     size=entry.get("size"), digest=entry.get("digest"),
+                                                                     logseq_layer=layer))
+        if legacy_paths:
+            # Cached before layers existed: these few files are read and parsed once
+            rules = self.state.get_compiled_rules()
+            for path in legacy_paths:
+                dirty_outputs.update(self._update_cache_for_file(path, deleted=not os.path.exists(path), rules=rules,
+                                                                 adv_opts=adv_opts, logseq_exclude_keys=logseq_exclude_keys))
+        self.metrics.incr("recomposed_outputs", len(dirty_outputs))
+
+        self._write_outputs(dirty_outputs)
+        self._refresh_active_outputs()
+        self.cache_manager.save_cache()
+        self.ui_cb['update_lists']()
+        self.ui_cb['set_status']("准备就绪。")
+
+    def _execute_apply_rule_change(self, old_rules):
+        """
+        Rules were edited: re-parse only the files on which a rule that differs
+        between the old and new rule lists could fire (see RuleChange). Each
+        cached source is read once and pre-matched against the changed rules;
+        every other file keeps its cached outputs.
+
+        Like initialize, the scan yields between files to due edits and
+        superseding tasks: results so far are written and saved, the task is
+        re-queued and the resumed run skips the files already checked.
+        """
+        new_rules = self.state.get_rules()
+        change = RuleChange(old_rules, new_rules)
+        # (rules the paused run checked against, paths it had checked)
+        resume, self.rule_change_resume = self.rule_change_resume, None
+        done, done_change = set(), None
+        if resume is not None:
+            paused_rules, done = resume
+            if paused_rules != new_rules:
+                # Edited again while paused: the checked files only need the newest difference
+                done_change = RuleChange(paused_rules, new_rules)
+        if change.is_noop and (done_change is None or done_change.is_noop): return
+        self.ui_cb['set_status']("清洗规则已变更，正在筛选受影响的文件...")
+        self.ui_cb['update_progress'](mode='determinate', val=0)
+        rules = self.state.get_compiled_rules()
+        adv_opts = self.state.get_advanced_options()
+        logseq_exclude_keys = self.state.get_logseq_exclude_keys()
+        dirty_outputs = set()
+        paths = self.cache_manager.get_all_cached_paths()
+        total = len(paths)
+        checked = affected = 0
+        preempted = False
+        # Only yield to work that runs before the re-queued scan: bulk tasks that do not absorb
+        # it would just hand the worker back
+        preempting = ("exit",) + tuple(name for name in ("clear_cache", "full_rescan")
+                                       if self.task_queue.absorbs(name, "apply_rule_change"))
+        for i, path in enumerate(paths):
+            if i % 50 == 0 and i:
+                self.ui_cb['set_status'](f"正在筛选受影响的文件（{i}/{total}）...")
+                self.ui_cb['update_progress'](val=i / total * 100)
+            file_change = change
+            if path in done:
+                if done_change is None: continue
+                file_change = done_change
+            if file_change.is_noop: continue
+            # Every run checks at least 50 files before it may yield, so a resumed scan always advances.
+            # A run that mixes two rule differences is finished in one go rather than paused again
+            if checked and checked % 50 == 0 and done_change is None and self._should_yield(preempting):
+                done.update(paths[:i])
+                preempted = True
+                break
+            checked += 1
+            try:
+                # Very large files are simply re-parsed (streamed) rather than loaded whole for the check
+                if os.stat(path).st_size >= STREAM_MIN_BYTES: hit = True
+                else:
+                    data, _ = read_source_bytes(path)
+                    hit = file_change.affects(decode_text(data))
+            except FileNotFoundError:
+                dirty_outputs.update(self._update_cache_for_file(path, deleted=True))
+                continue
+            except OSError as e:
+                # Locked by a sync client or antivirus: keep the cached entry and retry through the debouncer
+                print(f"Error reading {path}, will retry: {e}")
+                self.force_reparse.add(path)
+                self.put_task(("process_file", "modified", path))
+                continue
+            except Exception as e:
+                print(f"Error checking {path}: {e}")
+                hit = True
+            if hit:
+                affected += 1
+                dirty_outputs.update(self._update_cache_for_file(path, rules=rules, adv_opts=adv_opts,
+                                                                 logseq_exclude_keys=logseq_exclude_keys, force=True))
+        self.metrics.incr("rule_change_checked", checked)
+        self.metrics.incr("rule_change_reparsed", affected)
+
+        self._write_outputs(dirty_outputs)
+        self._refresh_active_outputs()
+        self.cache_manager.save_cache()
+        self.ui_cb['update_lists']()
+        self.ui_cb['update_progress'](val=0)
+        if preempted:
+            self.rule_change_resume = (new_rules, done)
+            self.metrics.incr("rule_change_preempted")
+            self.put_task(("apply_rule_change", old_rules))
+            self.ui_cb['set_status'](f"已暂停规则筛选（已检查 {len(done)}/{total} 个文件），优先处理新的改动...")
+            return
+        self.ui_cb['set_status'](f"清洗规则已应用：{total} 个文件中 {affected} 个受影响并已重新解析。")
+
+    def _update_single_output_file(self, lib):
+        self._write_outputs([lib])
+
+    def _write_outputs(self, libs):
+        """
+        Output-commit stage: decides per library whether it is written, removed
+        or only listed, then renders and writes the libraries concurrently and
+        renames them into place as one batch (see commit_files). The
+        "output_fsync" option flushes files and directories to disk; with
+        "output_all_or_nothing" a failed batch leaves every previous file as
+        it was, so QuickKV never loads a half-updated set of libraries.
+        Libraries that fail to commit are retried with the next batches (see
+        OUTPUT_RETRY_LIMIT) and committed apart from the batch from then on,
+        so one library that cannot be written never blocks the others.
+        """
+        retry = [lib for lib, failures in self.failed_outputs.items() if failures < OUTPUT_RETRY_LIMIT]
+        libs = set(libs).union(retry)
+        if not libs: return
+        # The destination folder is resolved at write time, never stored in the cache
+        base_dest = self.state.get_output_path()
+        # Skip export if the output path is not set (empty or fallback CWD)
+        exporting = bool(base_dest) and base_dest != os.getcwd()
+        blacklist = self.state.get_blacklist()
+        selection = self.state.get_output_selection()
+        adv_opts = self.state.get_advanced_options()
+
+        writes, removes = [], []
+        committed = {}  # output path -> library, for counting failures
+        for lib in libs:
+            output_path = self._resolve_output_path(lib, base_dest)
+            if not exporting:
+                self.state.add_active_output(output_path, "多元")
+                continue
+            committed[output_path] = lib
             # Check the blacklist first! If blacklisted, block everything.
-            blacklist = self.state.get_blacklist()
-            if basename in blacklist:
-                if os.path.exists(output_path):
-                    try:
-                        os.chmod(output_path, stat.S_IWRITE)
-                        os.remove(output_path)
-                    except Exception: pass
+            if lib in blacklist:
+                removes.append(output_path)
                 # Still add it to active outputs so it shows up in UI (to be un-blacklisted later if needed)
                 self.state.add_active_output(output_path, "多元")
-                return
+            elif selection.get(lib, False):
+                # The library model keeps lines ref-counted and sorted, so no union/sort is needed here
+                writes.append((output_path, functools.partial(self.cache_manager.render_output, lib)))
+            else:
+                removes.append(output_path)
+        if not writes and not removes: return
 
-            # Check if this output is enabled using AppState lock mechanism
-            selection = self.state.get_output_selection()
-            is_checked = selection.get(basename, False)
-            
-            if is_checked:
-                # Issue 4 Risk Mitigation: Atomic file saving to prevent corruption
-                atomic_write(output_path, full_content)
+        fsync = adv_opts.get("output_fsync", False)
+        failing = lambda path: committed[path] in self.failed_outputs
+        errors = self._commit_outputs([w for w in writes if not failing(w[0])],
+                                      [path for path in removes if not failing(path)],
+                                      fsync, adv_opts.get("output_all_or_nothing", False))
+        for write in writes:
+            if failing(write[0]):
+                errors.update(self._commit_outputs([write], [], fsync, False))
+        for path in removes:
+            if failing(path):
+                errors.update(self._commit_outputs([], [path], fsync, False))
+
+        for output_path, lib in committed.items():
+            e = errors.get(output_path)
+            if e is None:
+                self.failed_outputs.pop(lib, None)
+                continue
+            failures = self.failed_outputs[lib] = self.failed_outputs.get(lib, 0) + 1
+            if failures == 1:
+                print(f"Error writing {output_path}, will retry: {e}")
+            elif failures == OUTPUT_RETRY_LIMIT:
+                print(f"Giving up on {output_path} after {failures} failed writes until it changes again: {e}")
+        for output_path, e in errors.items():
+            if output_path not in committed:
+                print(f"Error syncing {output_path}: {e}")
+        for output_path, _ in writes:
+            if output_path not in errors:
                 self.state.add_active_output(output_path, "多元")
-            else:
-                if os.path.exists(output_path):
-                    try:
-                        os.chmod(output_path, stat.S_IWRITE)
-                        os.remove(output_path)
-                    except Exception: pass
-        except Exception as e: print(f"Error writing {output_path}: {e}")
+        self.metrics.incr("outputs_committed", sum(1 for path in committed if path not in errors))
+
+    @staticmethod
+    def _commit_outputs(writes, removes, fsync, all_or_nothing):
+        """Commits one batch with commit_files and returns {path: error} for whatever was not committed."""
+        if not writes and not removes: return {}
+        try:
+            return dict(commit_files(writes, removes, fsync=fsync, all_or_nothing=all_or_nothing))
+        except Exception as e:
+            # All or nothing: every file of the batch was rolled back
+            return {path: e for path in [path for path, _ in writes] + list(removes)}
 
     def _get_all_source_files(self):
         paths = []
@@ -0,0 +1,147 @@
+import collections
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+# Lower runs first; tasks of equal priority keep their submission order.
+# File events only mark files dirty, so they are recorded before any bulk
+# work starts and the debounced batch is never stuck behind a rescan.
+PRIORITY_EXIT = 0
+PRIORITY_FILE_EVENT = 1
+PRIORITY_NORMAL = 2
+PRIORITY_BULK = 3
+
+TASK_PRIORITIES = {
+    "exit": PRIORITY_EXIT,
+    "process_file": PRIORITY_FILE_EVENT,
+    "initialize": PRIORITY_BULK,
+    "full_rescan": PRIORITY_BULK,
+    "clear_cache": PRIORITY_BULK,
+}
+
+# A pending task absorbs any later or earlier pending task it covers:
+# clear_cache wipes the cache and re-initializes, full_rescan marks every entry
+# stale and re-parses it (re-emitting every output), initialize re-reads changed files.
+ABSORBS = {
+    "clear_cache": {"full_rescan", "initialize", "regenerate_output", "rewrite_outputs",
+                    "recompose_outputs", "apply_rule_change"},
+    "full_rescan": {"initialize", "regenerate_output", "rewrite_outputs",
+                    "recompose_outputs", "apply_rule_change"},
+}
+# While an interrupted rescan is unfinished, full_rescan resumes it without
+# marking entries stale again: files it already parsed keep their results, so
+# rule and composition changes must still run. It re-reads changed files and rewrites
+# every library when it completes, which still covers the output tasks.
+RESUME_ABSORBS = dict(ABSORBS, full_rescan={"initialize", "regenerate_output", "rewrite_outputs"})
+
+
+class TaskScheduler:
+    """
+    Priority queue for dispatcher tasks that coalesces redundant work.
+
+    Identical pending tasks collapse into one, a pending full_rescan or
+    clear_cache absorbs the initialize / regenerate_output / rewrite tasks it
+    would redo anyway (see set_resuming for a rescan that only resumes), and
+    queued apply_rule_change tasks merge into one that diffs against the
+    oldest rules (the current rules are read when it runs).
+    get() mirrors queue.Queue.get and raises queue.Empty on timeout.
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._heap = []
+        self._pending = {}  # coalescing key -> live heap entry [priority, seq, task]
+        self._names = collections.Counter()  # task name -> number of pending tasks
+        self._seq = itertools.count()
+        self._absorbs = ABSORBS
+
+    @staticmethod
+    def _key(task):
+        name = task[0]
+        if name == "apply_rule_change":
+            return (name,)
+        return task
+
+    def _drop(self, key):
+        """Marks a pending entry as removed; the heap skips it lazily."""
+        entry = self._pending.pop(key)
+        entry[2] = None
+        self._names[key[0]] -= 1
+
+    def _count_coalesced(self, amount=1):
+        if self.metrics is not None:
+            self.metrics.incr("tasks_coalesced", amount)
+
+    def put(self, task):
+        name = task[0]
+        with self._cond:
+            key = self._key(task)
+            if key in self._pending:
+                # Already queued; for rule changes the earliest old rules stay the base of the diff
+                self._count_coalesced()
+                return
+            if any(name in self._absorbs.get(other[0], ()) for other in self._pending):
+                self._count_coalesced()
+                return
+            covered = [other for other in self._pending if other[0] in self._absorbs.get(name, ())]
+            for other in covered:
+                self._drop(other)
+            if covered:
+                self._count_coalesced(len(covered))
+            entry = [TASK_PRIORITIES.get(name, PRIORITY_NORMAL), next(self._seq), task]
+            self._pending[key] = entry
+            self._names[name] += 1
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+
+    def set_resuming(self, resuming):
+        """Set while a rescan is unfinished: a pending full_rescan then absorbs only what RESUME_ABSORBS lists."""
+        with self._cond:
+            self._absorbs = RESUME_ABSORBS if resuming else ABSORBS
+
+    def absorbs(self, name, other):
+        """Whether a pending task called name would absorb one called other."""
+        with self._cond:
+            return other in self._absorbs.get(name, ())
+
+    def get(self, timeout=None):
+        """Blocks until a task is queued; with a timeout, raises queue.Empty once it has passed."""
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    break
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+            entry = heapq.heappop(self._heap)
+            task = entry[2]
+            del self._pending[self._key(task)]
+            self._names[task[0]] -= 1
+            return task
+
+    def has_pending(self, names):
+        """Whether a task with one of these names is waiting; cheap enough to poll per file."""
+        with self._cond:
+            return any(self._names[name] > 0 for name in names)
+
+    def take(self, name):
+        """Removes and returns every pending task with this name, in submission order."""
+        with self._cond:
+            if not self._names[name]:
+                return []
+            keys = [key for key in self._pending if key[0] == name]
+            tasks = [self._pending[key][2] for key in keys]
+            for key in keys:
+                self._drop(key)
+            return tasks
+
+    def depth(self):
+        """Number of tasks waiting to run (coalesced ones are not counted)."""
+        with self._cond:
+            return len(self._pending)
@@ -1,40 +1,70 @@
 import re
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
 
-class Node:
+from src.logic.rule_set import CompiledRuleSet
+
+# 行尾标签：#KV树-词库名[-父与子|-不包含父]，全模块共用一个预编译模式
+TAG_PATTERN = re.compile(r'^(?P<content>.*?)\s*(?P<tag>#KV树-(?P<lib>[^-]+)(?:-(?P<mode>父与子|不包含父))?)$')
+TAG_MARKER = '#KV树'
+
+# mode 数组中的取值
+MODE_NONE = 0        # 无标签，或单行标签
+MODE_WITH_PARENT = 1 # '父与子'
+MODE_NO_PARENT = 2   # '不包含父'
+_MODE_CODES = {None: MODE_NONE, '父与子': MODE_WITH_PARENT, '不包含父': MODE_NO_PARENT}
+
+
+class CompactTree:
     """
-    表示 AST 中的一个节点，对应于源文本中的一行。
+    紧凑的数组式 AST：每个节点对应一个非空行，节点 0 为虚拟根。
+
+    各属性是按节点下标对齐的并行数组：
+      line_no      节点在 lines 中的行号（根为 -1）
+      indent       缩进量
+      parent       父节点下标
+      lib_id       标签词库在 libs 中的下标，无标签为 -1
+      mode         MODE_NONE / MODE_WITH_PARENT / MODE_NO_PARENT
+      first_child  第一个子节点下标，无则 -1
+      next_sibling 下一个兄弟节点下标，无则 -1
+    行文本不复制，始终通过 line_no 引用（经规则处理后的）lines。
     """
-    def __init__(self, raw_line: str, indent: int, parent=None):
-        self.raw_line = raw_line  # 原始行内容
-        self.indent = indent      # 缩进级别
-        self.parent = parent      # 父节点
-        self.children = []        # 子节点列表
-        self.tag = None           # 解析出的标签信息 (e.g., {'lib': '读书词库', 'mode': '父与子'})
-        self.content = self._parse_content() # 去除标签后的纯内容
-
-    def _parse_content(self):
-        """从原始行中解析出标签和纯内容。"""
-        tag_pattern = re.compile(r'^(?P<content>.*?)\s*(?P<tag>#KV树-(?P<lib>[^-]+)(?:-(?P<mode>父与子|不包含父))?)$')
-        match = tag_pattern.search(self.raw_line.strip())
-        if match:
-            gd = match.groupdict()
-            self.tag = {
-                'lib': f"#KV树-{gd['lib']}.md",
-                'mode': gd['mode']
-            }
-            # 返回移除了标签和前导 `- ` 的内容
-            return gd['content'].lstrip('- ').strip()
-        # 如果没有标签，同样移除前导 `- `
-        return self.raw_line.strip().lstrip('- ').strip()
-
-    def add_child(self, node):
-        """添加一个子节点。"""
-        self.children.append(node)
-        node.parent = self
-
-    def __repr__(self):
-        return f"Node(indent={self.indent}, content='{self.content}', tag={self.tag})"
+    __slots__ = ("lines", "line_no", "indent", "parent", "lib_id", "mode",
+                 "first_child", "next_sibling", "libs", "has_block_tags")
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.line_no = array('i', [-1])
+        self.indent = array('i', [-1])
+        self.parent = array('i', [-1])
+        self.lib_id = array('i', [-1])
+        self.mode = array('b', [MODE_NONE])
+        self.first_child = array('i', [-1])
+        self.next_sibling = array('i', [-1])
+        self.libs = []
+        self.has_block_tags = False
+
+    def __len__(self):
+        return len(self.line_no)
+
+    def text(self, node: int) -> str:
+        return self.lines[self.line_no[node]]
+
+    def preorder(self):
+        """按先序（不含根）迭代节点下标，不使用递归。"""
+        first_child, next_sibling, parent = self.first_child, self.next_sibling, self.parent
+        node = first_child[0]
+        while node != -1:
+            yield node
+            if first_child[node] != -1:
+                node = first_child[node]
+                continue
+            while node and next_sibling[node] == -1:
+                node = parent[node]
+            if not node:
+                return
+            node = next_sibling[node]
 
 
 class AstParser:
@@ -45,36 +75,70 @@ class AstParser:
         """计算字符串的缩进量。"""
         return len(s) - len(s.lstrip(' \t'))
 
-    def _build_ast(self, lines: list[str]) -> Node:
+    def _build_ast(self, lines: list[str]) -> CompactTree:
         """
-        从文本行构建一个 AST。
+        从文本行构建紧凑 AST（单次遍历）。
+
+        父节点 = 此前出现过的、小于当前缩进的最大缩进上最近的那个节点。更深的
+        “过期”缩进也会保留（与旧实现的语义完全一致），因此用有序缩进表做二分查找，
+        每行 O(log 不同缩进数)，而不是每行都对全部缩进重新排序。
         """
-        root = Node("root", -1)
-        last_node_at_indent = {-1: root}
+        tree = CompactTree(lines)
+        line_nos, indents, parents = tree.line_no, tree.indent, tree.parent
+        lib_ids, modes = tree.lib_id, tree.mode
+        first_child, next_sibling = tree.first_child, tree.next_sibling
+        last_child = [-1]
+        lib_index = {}
 
-        for line in lines:
-            if not line.strip():
+        last_node_at_indent = {-1: 0}
+        known_indents = [-1]  # 已出现过的缩进，保持有序
+
+        for line_no, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped:
                 continue # 暂时忽略空行，后续可以作为节点处理
 
-            indent = self.get_indent(line)
+            indent = len(line) - len(line.lstrip(' \t'))
             
             # 找到正确的父节点
-            parent_indent = -1
-            for i in sorted(last_node_at_indent.keys(), reverse=True):
-                if indent > i:
-                    parent_indent = i
-                    break
-            
-            parent_node = last_node_at_indent[parent_indent]
-            
-            new_node = Node(line, indent, parent=parent_node)
-            parent_node.add_child(new_node)
+            pos = bisect_left(known_indents, indent)
+            parent = last_node_at_indent[known_indents[pos - 1]]
+
+            lib_id, mode = -1, MODE_NONE
+            if TAG_MARKER in stripped:
+                match = TAG_PATTERN.match(stripped)
+                if match:
+                    lib = f"#KV树-{match.group('lib')}.md"
+                    lib_id = lib_index.get(lib)
+                    if lib_id is None:
+                        lib_id = lib_index[lib] = len(tree.libs)
+                        tree.libs.append(lib)
+                    mode = _MODE_CODES[match.group('mode')]
+                    if mode:
+                        tree.has_block_tags = True
+
+            node = len(line_nos)
+            line_nos.append(line_no)
+            indents.append(indent)
+            parents.append(parent)
+            lib_ids.append(lib_id)
+            modes.append(mode)
+            first_child.append(-1)
+            next_sibling.append(-1)
+            last_child.append(-1)
+            if last_child[parent] == -1:
+                first_child[parent] = node
+            else:
+                next_sibling[last_child[parent]] = node
+            last_child[parent] = node
             
-            last_node_at_indent[indent] = new_node
+            if pos == len(known_indents) or known_indents[pos] != indent:
+                known_indents.insert(pos, indent)
+            last_node_at_indent[indent] = node
 
-        return root
+        return tree
 
-    def parse(self, text: str, rules: dict = None) -> tuple[dict, list]:
+    def parse(self, text: str, rules=None) -> tuple[dict, list]:
         """
         解析文本并返回结果。
         这是将替换旧解析器的主入口点。
@@ -87,137 +151,248 @@ class AstParser:
         lines = text.split('\n')
         processed_lines = self._preprocess_lines(lines, rules)
 
-        # 2. 构建 AST
-        root = self._build_ast(processed_lines)
-
-        # 3. 从 AST 中提取数据
-        kv_trees = self._extract_data(root)
+        # 2. 提取块条目与单行条目，块条目在前
+        block_entries, single_entries = self.parse_lines(processed_lines)
+        kv_trees = defaultdict(list)
+        for phase in (block_entries, single_entries):
+            for lib, entries in phase.items():
+                kv_trees[lib].extend(entries)
 
-        # 4. 格式化最终输出
+        # 3. 格式化最终输出
         final_results = {lib: list(dict.fromkeys(entries)) for lib, entries in kv_trees.items()}
         return final_results, [] # 暂时不处理冲突
 
-    def _preprocess_lines(self, lines: list[str], rules: dict) -> list[str]:
-        """根据规则列表清理和替换内容。"""
-        if not rules or not isinstance(rules, dict):
+    def parse_stream(self, lines, rules=None):
+        """
+        流式解析：逐行消费已解码、不含换行符的行（可以是生成器），边读边处理 Tab、
+        应用规则并构建输出，内存中只保留当前最右路径（与大纲深度成正比）和输出条目。
+
+        结果与 parse 完全一致。没有“过期缩进”挂接时树的先序就是行序，父节点总在
+        最右路径上；一旦遇到挂到过期缩进上的节点就返回 None，由调用方改用整篇解析。
+        """
+        if not isinstance(rules, CompiledRuleSet):
+            rules = CompiledRuleSet.from_rules(rules) if rules and isinstance(rules, dict) else None
+        apply = rules.apply if rules is not None and rules.has_rules else None
+
+        block_slots = []  # 每个块标签节点一项 [词库, 条目, 基准缩进, 模式]，按先序排列
+        single_entries = defaultdict(list)
+        known_indents = [-1]
+        # 最右路径上的节点：(缩进, 子节点输出到的块, 自身定义的块)
+        path = [(-1, None, None)]
+
+        for line in lines:
+            line = line.replace('\t', '    ')
+            if apply is not None:
+                line = apply(line)
+                if line is None:
+                    continue
+            stripped = line.strip()
+            if not stripped:
+                continue
+
+            indent = len(line) - len(line.lstrip(' \t'))
+            while path[-1][0] >= indent:
+                path.pop()
+            pos = bisect_left(known_indents, indent)
+            if known_indents[pos - 1] != path[-1][0]:
+                return None
+            if pos == len(known_indents) or known_indents[pos] != indent:
+                known_indents.insert(pos, indent)
+
+            _, target, parent_slot = path[-1]
+            if parent_slot is not None and parent_slot[2] is None:
+                parent_slot[2] = indent  # 块的第一个子节点决定'不包含父'的基准缩进
+
+            lib = mode = None
+            if TAG_MARKER in stripped:
+                match = TAG_PATTERN.match(stripped)
+                if match:
+                    lib = f"#KV树-{match.group('lib')}.md"
+                    mode = _MODE_CODES[match.group('mode')]
+
+            if mode:
+                # 块标签节点不属于外层块，它的子树由自己的块输出
+                slot = [lib, [], None, mode]
+                if mode == MODE_WITH_PARENT:
+                    slot[1].append(line.split('#KV树')[0].rstrip())
+                block_slots.append(slot)
+                path.append((indent, slot, slot))
+                continue
+
+            if target is not None:
+                output_line = line.split('#KV树')[0].rstrip() if lib else line
+                if target[3] == MODE_NO_PARENT:
+                    output_line = ' ' * (indent - target[2]) + output_line.lstrip()
+                target[1].append(output_line)
+
+            if lib:
+                content = line.split('#KV树')[0].strip().lstrip('-').strip()
+                single_entries[lib].append(f"- {content}")
+                target = None  # 带标签的节点不再向下展开
+            path.append((indent, target, None))
+
+        kv_trees = defaultdict(list)
+        for lib, entries, _, _ in block_slots:
+            if entries:
+                kv_trees[lib].extend(entries)
+        for lib, entries in single_entries.items():
+            kv_trees[lib].extend(entries)
+        final_results = {lib: list(dict.fromkeys(entries)) for lib, entries in kv_trees.items()}
+        return final_results, []
+
+    def parse_lines(self, lines: list[str]) -> tuple[dict, dict]:
+        """
+        解析已经过规则处理的行，返回 (块条目, 单行条目) 两个 {词库: [条目]} 字典，
+        均按树的先序排列、尚未去重。增量解析器按顶层块分别调用它再拼接。
+        """
+        # 快速路径：只有单行标签时无需建树
+        single_entries = self._extract_single_line_tags(lines)
+        if single_entries is not None:
+            return {}, single_entries
+        # 构建 AST 并从中提取数据
+        return self._extract_data(self._build_ast(lines))
+
+    def _preprocess_lines(self, lines: list[str], rules) -> list[str]:
+        """根据规则集清理和替换内容。rules 可以是预编译的 CompiledRuleSet 或原始规则字典。"""
+        if not isinstance(rules, CompiledRuleSet):
+            if not rules or not isinstance(rules, dict):
+                return lines
+            rules = CompiledRuleSet.from_rules(rules)
+        if not rules.has_rules:
             return lines
-            
-        line_rules = rules.get("line_rules", [])
-        content_rules = rules.get("content_rules", [])
-
-        compiled_line = []
-        for r in line_rules:
-            try:
-                compiled_line.append({
-                    "match": re.compile(r.get("match", "")),
-                    "replace": r.get("replace", "")
-                })
-            except Exception: pass
-            
-        compiled_content = []
-        for r in content_rules:
-            try:
-                compiled_content.append({
-                    "match": re.compile(r.get("match", "")),
-                    "replace": r.get("replace", "")
-                })
-            except Exception: pass
 
+        apply = rules.apply
         processed_lines = []
         for line in lines:
-            drop_line = False
-            # 1. 优先执行“排除行”规则
-            for cr in compiled_line:
-                if cr["match"].search(line):
-                    repl = cr["replace"]
-                    if not repl:
-                        drop_line = True
-                        break
-                    else:
-                        line = cr["match"].sub(repl, line)
-            
-            if drop_line:
-                continue
-                
-            # 2. 执行“排除内容”规则
-            for cr in compiled_content:
-                line = cr["match"].sub(cr["replace"], line)
-                
-            processed_lines.append(line)
+            line = apply(line)
+            if line is not None:
+                processed_lines.append(line)
 
         return processed_lines
 
-    def _extract_data(self, root: Node) -> defaultdict:
+    def _extract_single_line_tags(self, lines: list[str]):
+        """
+        快速路径：一次线性扫描收集单行标签。只要出现块标签（父与子/不包含父）
+        就返回 None，交给完整的 AST 路径处理。
+
+        单行标签的输出顺序是树的先序；只有出现“过期缩进”父节点时先序才会与行序
+        不同，此时同样回退到完整路径，以保证结果与建树完全一致。
+        """
+        tagged = []
+        for line in lines:
+            if TAG_MARKER not in line:
+                continue
+            match = TAG_PATTERN.match(line.strip())
+            if not match:
+                continue
+            if match.group('mode'):
+                return None
+            content = line.split('#KV树')[0].strip().lstrip('-').strip()
+            tagged.append((f"#KV树-{match.group('lib')}.md", f"- {content}"))
+
         kv_trees = defaultdict(list)
-        processed_nodes = set()
+        for lib, entry in tagged:
+            kv_trees[lib].append(entry)
+        # 每个词库最多一个不同条目时顺序无关紧要，省去缩进检查
+        if any(len(set(entries)) > 1 for entries in kv_trees.values()) and self._has_stale_parents(lines):
+            return None
+        return kv_trees
 
-        all_nodes = []
-        def get_all_nodes(node):
-            all_nodes.append(node)
-            for child in node.children:
-                get_all_nodes(child)
-        get_all_nodes(root)
+    def _has_stale_parents(self, lines: list[str]) -> bool:
+        """
+        判断是否有节点会挂到“过期缩进”上的父节点（即不在当前最右路径上），
+        这种情况下树的先序与行序不一致。只追踪缩进，不建树。
+        """
+        known_indents = [-1]
+        path = [-1]  # 当前最右路径上各节点的缩进
+        for line in lines:
+            if not line.strip():
+                continue
+            indent = len(line) - len(line.lstrip(' \t'))
+            while path[-1] >= indent:
+                path.pop()
+            pos = bisect_left(known_indents, indent)
+            if known_indents[pos - 1] != path[-1]:
+                return True
+            path.append(indent)
+            if pos == len(known_indents) or known_indents[pos] != indent:
+                known_indents.insert(pos, indent)
+        return False
+
+    def _extract_data(self, tree: CompactTree) -> tuple[defaultdict, defaultdict]:
+        kv_trees = defaultdict(list)
+        single_entries = defaultdict(list)
+        libs, lib_ids, modes = tree.libs, tree.lib_id, tree.mode
 
         # Phase 1: Process block-level tags ('父与子', '不包含父')
-        for node in all_nodes:
-            if node in processed_nodes or not node.tag or not node.tag.get('mode'):
-                continue
-            
-            lib = node.tag['lib']
-            mode = node.tag['mode']
-            
-            processed_nodes.add(node) # Mark parent as processed
+        if tree.has_block_tags:
+            for node in tree.preorder():
+                mode = modes[node]
+                if not mode:
+                    continue
+                
+                lib = libs[lib_ids[node]]
 
-            if mode == '父与子':
-                kv_trees[lib].append(node.raw_line.split('#KV树')[0].rstrip())
-                self._render_block_children(node, lib, -1, kv_trees, processed_nodes)
-            
-            elif mode == '不包含父':
-                base_indent = -1
-                if node.children:
-                    for child in node.children:
-                        if child.raw_line.strip():
-                            base_indent = child.indent
-                            break
-                    if base_indent != -1:
-                        self._render_block_children(node, lib, base_indent, kv_trees, processed_nodes)
+                if mode == MODE_WITH_PARENT:
+                    kv_trees[lib].append(tree.text(node).split('#KV树')[0].rstrip())
+                    self._render_block_children(tree, node, lib, -1, kv_trees)
+                
+                elif mode == MODE_NO_PARENT:
+                    first = tree.first_child[node]
+                    if first != -1:
+                        self._render_block_children(tree, node, lib, tree.indent[first], kv_trees)
 
         # Phase 2: Process all remaining single-line tags
-        for node in all_nodes:
+        for node in tree.preorder():
             # Bug fix: If a node has a tag, AND it is a pure single-line tag (no 'mode' like 父与子),
             # it MUST be rendered as a single-line output EVEN IF it was already processed as part of a block.
-            if not node.tag or node.tag.get('mode'):
+            if lib_ids[node] == -1 or modes[node]:
                 continue
             
-            lib = node.tag['lib']
+            lib = libs[lib_ids[node]]
             # For single lines, we always want un-indented content.
-            content = node.raw_line.split('#KV树')[0].strip().lstrip('-').strip()
-            kv_trees[lib].append(f"- {content}")
-            processed_nodes.add(node)
+            content = tree.text(node).split('#KV树')[0].strip().lstrip('-').strip()
+            single_entries[lib].append(f"- {content}")
 
-        return kv_trees
+        return kv_trees, single_entries
 
-    def _render_block_children(self, parent_node: Node, lib: str, base_indent: int, kv_trees: defaultdict, processed_nodes: set):
-        """ Renders all children of a block-defining node. """
-        for node in parent_node.children:
-            if node in processed_nodes:
+    def _render_block_children(self, tree: CompactTree, block_node: int, lib: str, base_indent: int, kv_trees: defaultdict):
+        """
+        Renders all children of a block-defining node (iterative pre-order walk).
+        Every node belongs to at most one block (its nearest tagged ancestor), so no
+        processed-node bookkeeping is needed.
+        """
+        lines, line_nos, indents = tree.lines, tree.line_no, tree.indent
+        lib_ids, modes = tree.lib_id, tree.mode
+        first_child, next_sibling = tree.first_child, tree.next_sibling
+        out = None  # 只有真正输出了内容才创建该词库的条目
+
+        stack = [first_child[block_node]]
+        while stack:
+            node = stack[-1]
+            if node == -1:
+                stack.pop()
                 continue
+            stack[-1] = next_sibling[node]
             
             # If a child defines its own block, stop rendering this branch.
-            if node.tag and node.tag.get('mode'):
+            if modes[node]:
                 continue
 
-            processed_nodes.add(node)
-            
-            line = node.raw_line.split('#KV树')[0].rstrip() if node.tag else node.raw_line
+            is_tagged = lib_ids[node] != -1
+            line = lines[line_nos[node]]
+            if is_tagged:
+                line = line.split('#KV树')[0].rstrip()
 
             if base_indent != -1: # '不包含父' mode
-                output_line = ' ' * (node.indent - base_indent) + line.lstrip()
+                output_line = ' ' * (indents[node] - base_indent) + line.lstrip()
             else: # '父与子' mode
                 output_line = line
             
-            kv_trees[lib].append(output_line)
+            if out is None:
+                out = kv_trees[lib]
+            out.append(output_line)
 
-            # Recurse only if the node is NOT a tag itself.
-            if not node.tag:
-                self._render_block_children(node, lib, base_indent, kv_trees, processed_nodes)
+            # Descend only if the node is NOT a tag itself.
+            if not is_tagged:
+                stack.append(first_child[node])
@@ -0,0 +1,255 @@
+# app_logic/cache_backends.py
+# 解析缓存的持久化后端：JSON（整文件重写）与 SQLite（按行增量写入）
+
+import hashlib
+import json
+import os
+import sqlite3
+
+# 这些字段是解析结果（载荷）；内容相同的文件载荷相同，在 SQLite 中只存一份
+PAYLOAD_KEYS = ("outputs", "logseq")
+
+class JsonCacheBackend:
+    """传统的单文件 JSON 缓存，每次保存都整体重写。"""
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+
+    def load(self):
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, IOError):
+                # 如果文件损坏或无法读取，则视为空缓存
+                return {}
+        return {}
+
+    def save(self, cache_data, changed, removed, full=False):
+        try:
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(cache_data, f, ensure_ascii=False, indent=4)
+        except IOError as e:
+            print(f"Error saving cache file: {e}")
+
+    def wipe(self):
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+
+    def close(self):
+        pass
+
+
+class SqliteCacheBackend:
+    """
+    基于 SQLite (WAL 模式) 的缓存，每个源文件一行。
+    保存时只在一个事务里 upsert/删除发生变化的行，而不是重写整个缓存。
+    首次启动时会自动把同名的 parsing_cache.json 迁移进来。
+
+    从版本 2 起，条目的解析载荷（outputs、logseq）按内容哈希存入 payloads 表，
+    entries 行只保存 mtime/摘要等元数据和载荷键，重复文件共用一行载荷。
+    payload 列为空的旧行仍按完整条目读取，下次变动时再改写为新格式。
+    """
+    SCHEMA_VERSION = 2
+
+    def __init__(self, cache_file, legacy_json_file=None):
+        self.cache_file = cache_file
+        self.legacy_json_file = legacy_json_file
+        self.conn = None
+
+    @staticmethod
+    def _is_corrupt(e):
+        # 文件不是数据库 (SQLITE_NOTADB) 或镜像损坏 (SQLITE_CORRUPT) 只会抛出 DatabaseError 本身，
+        # 锁冲突、约束错误等则是它的子类，不能因此删除缓存
+        return type(e) is sqlite3.DatabaseError
+
+    def _connect(self):
+        if self.conn is not None:
+            return self.conn
+        try:
+            self.conn = self._open()
+        except sqlite3.DatabaseError as e:
+            if not self._is_corrupt(e):
+                raise
+            print(f"Cache database is corrupt ({e}), recreating it")
+            self._recreate()
+        return self.conn
+
+    def _recreate(self):
+        """数据库损坏时：关闭连接，删除 .db 及其 -wal/-shm 文件，再重建空的表结构。"""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+            self.conn = None
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.cache_file + suffix)
+            except FileNotFoundError:
+                pass
+        self.conn = self._open()
+        return self.conn
+
+    def _open(self):
+        dir_name = os.path.dirname(self.cache_file)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        # 由 CacheManager 的锁保证串行访问，因此允许跨线程使用同一连接
+        conn = sqlite3.connect(self.cache_file, check_same_thread=False)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, data TEXT NOT NULL)")
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+                if "payload" not in columns:
+                    conn.execute("ALTER TABLE entries ADD COLUMN payload TEXT")
+                conn.execute("CREATE INDEX IF NOT EXISTS entries_payload ON entries (payload)")
+                conn.execute("CREATE TABLE IF NOT EXISTS payloads (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+                conn.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+        except sqlite3.Error:
+            # 先关闭连接，否则 Windows 上无法删除这个损坏的文件
+            conn.close()
+            raise
+        return conn
+
+    def load(self):
+        try:
+            conn = self._connect()
+            self._migrate_legacy_json(conn)
+            cache_data = {}
+            payloads = {}  # 每个载荷只解码一次，共用它的条目引用同一个对象
+            rows = conn.execute("SELECT e.path, e.data, e.payload, p.data FROM entries e "
+                                "LEFT JOIN payloads p ON p.key = e.payload")
+            for path, data, payload_key, payload_data in rows:
+                try:
+                    entry = json.loads(data)
+                    if payload_key is not None:
+                        if payload_data is None:
+                            continue  # 载荷丢失：丢弃该条目，下次启动时重新解析
+                        if payload_key not in payloads:
+                            payloads[payload_key] = json.loads(payload_data)
+                        entry.update(payloads[payload_key])
+                except json.JSONDecodeError:
+                    continue
+                cache_data[path] = entry
+            return cache_data
+        except sqlite3.Error as e:
+            print(f"Error loading cache database: {e}")
+            if self._is_corrupt(e):
+                # 与旧版 JSON 缓存损坏时一样视为空缓存，但要换成一个可写的新库，否则之后每次保存都会失败
+                try:
+                    self._recreate()
+                except (sqlite3.Error, OSError) as e2:
+                    print(f"Error recreating cache database: {e2}")
+            return {}
+
+    def _migrate_legacy_json(self, conn):
+        """数据库为空且存在旧版 JSON 缓存时，一次性导入并删除旧文件。"""
+        if not self.legacy_json_file or not os.path.exists(self.legacy_json_file):
+            return
+        if conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone():
+            return
+        legacy = JsonCacheBackend(self.legacy_json_file).load()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (path, data) VALUES (?, ?)",
+                ((path, json.dumps(entry, ensure_ascii=False)) for path, entry in legacy.items())
+            )
+        try:
+            os.remove(self.legacy_json_file)
+        except OSError:
+            pass
+
+    def save(self, cache_data, changed, removed, full=False):
+        try:
+            self._save(cache_data, changed, removed, full)
+        except sqlite3.Error as e:
+            print(f"Error saving cache database: {e}")
+            if not self._is_corrupt(e):
+                return
+            # 库在运行中损坏：重建后把内存中的全部条目完整写入
+            try:
+                self._recreate()
+                self._save(cache_data, (), (), full=True)
+            except (sqlite3.Error, OSError) as e2:
+                print(f"Error recreating cache database: {e2}")
+
+    def _save(self, cache_data, changed, removed, full):
+        conn = self._connect()
+        with conn:
+            if full:
+                conn.execute("DELETE FROM entries")
+                changed = cache_data.keys()
+                replaced = ()
+            else:
+                # 本次被替换或删除的条目原先引用的载荷，保存后只需检查它们是否还有引用
+                replaced = self._payload_keys(conn, set(changed).union(removed))
+            conn.executemany(
+                "DELETE FROM entries WHERE path = ?",
+                ((path,) for path in removed)
+            )
+            rows, payloads = self._split_entries(cache_data, changed)
+            conn.executemany("INSERT OR IGNORE INTO payloads (key, data) VALUES (?, ?)", payloads.items())
+            conn.executemany("INSERT OR REPLACE INTO entries (path, data, payload) VALUES (?, ?, ?)", rows)
+            # 不再被任何条目引用的载荷随之删除；全量保存时整表清理
+            if full:
+                conn.execute("DELETE FROM payloads WHERE key NOT IN (SELECT payload FROM entries WHERE payload IS NOT NULL)")
+            else:
+                conn.executemany(
+                    "DELETE FROM payloads WHERE key = ? AND NOT EXISTS (SELECT 1 FROM entries WHERE payload = ?)",
+                    ((key, key) for key in replaced)
+                )
+
+    @staticmethod
+    def _payload_keys(conn, paths):
+        """paths 当前引用的载荷键；分批查询以免超出 SQLite 的参数个数上限。"""
+        paths = list(paths)
+        keys = set()
+        for i in range(0, len(paths), 500):
+            batch = paths[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            keys.update(row[0] for row in conn.execute(
+                f"SELECT payload FROM entries WHERE path IN ({marks}) AND payload IS NOT NULL", batch))
+        return keys
+
+    @staticmethod
+    def _split_entries(cache_data, paths):
+        """把条目拆成 (路径, 元数据, 载荷键) 行和 {载荷键: 载荷}；共用的载荷对象只序列化一次。"""
+        rows = []
+        payloads = {}
+        keys_by_object = {}
+        for path in paths:
+            entry = cache_data.get(path)
+            if entry is None:
+                continue
+            parts = tuple(entry.get(k) for k in PAYLOAD_KEYS)
+            object_key = tuple(map(id, parts))
+            key = keys_by_object.get(object_key)
+            if key is None:
+                payload = {k: v for k, v in zip(PAYLOAD_KEYS, parts) if v is not None}
+                data = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+                key = hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+                keys_by_object[object_key] = key
+                payloads[key] = data
+            meta = {k: v for k, v in entry.items() if k not in PAYLOAD_KEYS}
+            rows.append((path, json.dumps(meta, ensure_ascii=False), key))
+        return rows, payloads
+
+    def wipe(self):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM entries")
+                conn.execute("DELETE FROM payloads")
+            conn.execute("VACUUM")
+        except sqlite3.DatabaseError as e:
+            if not self._is_corrupt(e):
+                raise
+            # 损坏的库无法清空，直接删除文件重建，“清除缓存”因此总能恢复
+            self._recreate()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
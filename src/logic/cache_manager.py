@@ -1,72 +1,314 @@
 # app_logic/cache_manager.py
-# 负责管理解析缓存 (parsing_cache.json)
+# 负责管理解析缓存 (parsing_cache.db / parsing_cache.json)
 
-import json
+import collections
 import os
 import threading
 
+from src.logic.cache_backends import JsonCacheBackend, SqliteCacheBackend
+from src.logic.library_model import LibraryModel
+
 class CacheManager:
-    def __init__(self, cache_file_path):
+    def __init__(self, cache_file_path, backend=None):
+        """
+        Args:
+            cache_file_path (str): 缓存文件路径。
+            backend (str): "sqlite" 或 "json"；缺省时按扩展名推断 (.db 为 SQLite)。
+        """
         self.cache_file = cache_file_path
+        if backend is None:
+            backend = "sqlite" if cache_file_path.endswith(".db") else "json"
+        if backend == "sqlite":
+            legacy_json = os.path.splitext(cache_file_path)[0] + ".json"
+            self.backend = SqliteCacheBackend(cache_file_path, legacy_json_file=legacy_json)
+        else:
+            self.backend = JsonCacheBackend(cache_file_path)
         self.cache_data = {}
+        # 词库文件名 -> 输出中含有该词库的条目数，用于列出缓存中出现过的全部词库
+        self.library_refs = collections.Counter()
+        # 每个输出词库的行级引用计数模型，用于增量更新与按需重写
+        self.libraries = {}
+        # 内容索引：内容摘要 -> {带完整解析层的源文件}，内容相同的文件可直接复用解析结果
+        self.digest_index = {}
+        # 自上次保存以来变动/删除的条目，只有这些行需要写回后端
+        self._changed = set()
+        self._removed = set()
+        self._full_save = False
+        self._loaded = False
         self.lock = threading.Lock() # 线程锁，确保多线程写入安全
-        self.load_cache()
 
     def load_cache(self):
-        """从文件加载缓存到内存中。"""
+        """从后端加载缓存到内存中。"""
         with self.lock:
-            if os.path.exists(self.cache_file):
-                try:
-                    with open(self.cache_file, 'r', encoding='utf-8') as f:
-                        self.cache_data = json.load(f)
-                except (json.JSONDecodeError, IOError):
-                    # 如果文件损坏或无法读取，则视为空缓存
-                    self.cache_data = {}
-            else:
-                self.cache_data = {}
+            self._load_locked()
+
+    def _load_locked(self):
+        self.cache_data = self.backend.load()
+        self._changed.clear()
+        self._removed.clear()
+        self._full_save = False
+        self._loaded = True
+        self._migrate_output_keys()
+        self._rebuild_index()
+        self._rebuild_digest_index()
+        self._rebuild_libraries()
+
+    def _ensure_loaded(self):
+        # 延迟加载：首次访问时（通常在后台线程）才读取缓存，避免阻塞启动
+        if not self._loaded:
+            self._load_locked()
 
     def save_cache(self):
-        """将内存中的缓存数据保存到文件。"""
+        """将内存中变动过的缓存条目写回后端。"""
+        with self.lock:
+            if not self._loaded:
+                return
+            if not (self._changed or self._removed or self._full_save):
+                return
+            self.backend.save(self.cache_data, self._changed, self._removed, full=self._full_save)
+            self._changed.clear()
+            self._removed.clear()
+            self._full_save = False
+
+    def clear(self):
+        """清空内存中的缓存及其索引（不删除磁盘文件，下次保存时整体覆盖）。"""
         with self.lock:
-            try:
-                with open(self.cache_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.cache_data, f, ensure_ascii=False, indent=4)
-            except IOError as e:
-                print(f"Error saving cache file: {e}")
+            self.cache_data.clear()
+            self.library_refs.clear()
+            self.libraries.clear()
+            self.digest_index.clear()
+            self._changed.clear()
+            self._removed.clear()
+            self._full_save = True
+            self._loaded = True
+
+    def mark_all_stale(self):
+        """
+        全量重建用：保留全部条目及其输出，只清除 mtime、大小和内容摘要，
+        使每个文件在下次初始化时都被重新解析并逐个替换，重建期间词库始终完整。
+        标记随缓存一起保存，重建中断（包括退出程序）后下次初始化会继续。
+        """
+        with self.lock:
+            self._ensure_loaded()
+            for file_path, entry in self.cache_data.items():
+                # 过期条目的解析层不再作为其他文件的复用来源
+                self._unindex_digest(file_path, entry)
+                entry["mtime"] = None
+                entry.pop("size", None)
+                entry.pop("digest", None)
+                self._changed.add(file_path)
+
+    def get_stale_paths(self):
+        """获取全量重建中尚未重新解析的文件路径列表。"""
+        with self.lock:
+            self._ensure_loaded()
+            return [path for path, entry in self.cache_data.items() if entry.get("mtime") is None]
+
+    def wipe(self):
+        """清空内存缓存并删除磁盘上的缓存数据。"""
+        with self.lock:
+            self.cache_data.clear()
+            self.library_refs.clear()
+            self.libraries.clear()
+            self.digest_index.clear()
+            self._changed.clear()
+            self._removed.clear()
+            self._full_save = False
+            self._loaded = True
+            self.backend.wipe()
+
+    def close(self):
+        with self.lock:
+            self.backend.close()
 
     def get_entry(self, file_path):
         """获取单个文件的缓存条目。"""
         with self.lock:
+            self._ensure_loaded()
             return self.cache_data.get(file_path)
 
-    def update_entry(self, file_path, mtime, generated_outputs):
+    def update_entry(self, file_path, mtime, generated_outputs, size=None, digest=None, logseq_layer=None):
         """
         更新或添加一个文件的缓存条目。
         
         Args:
             file_path (str): 源文件的绝对路径。
             mtime (float): 源文件的最后修改时间。
-            generated_outputs (dict): 由此文件生成的输出文件信息 {output_path: [entry1, entry2], ...}
+            generated_outputs (dict): 由此文件生成的词库内容 {词库文件名: "entry1\nentry2", ...}
+            size (int): 源文件字节数，与 digest 一起用于判断内容是否真正变化。
+            digest (str): 源文件内容摘要；为 None 时该条目只能依靠 mtime 校验。
+            logseq_layer (dict): 与扫描选项无关的原始 Logseq 属性层，切换选项时据此重新组合输出。
+
+        Returns:
+            set: 因本次更新而发生成员变化（需要重写）的输出文件。
         """
         with self.lock:
-            self.cache_data[file_path] = {
+            self._ensure_loaded()
+            old_entry = self.cache_data.get(file_path)
+            old_outputs = old_entry.get("outputs", {}) if old_entry else {}
+            if old_entry:
+                self._unindex(old_outputs)
+                self._unindex_digest(file_path, old_entry)
+            entry = {
                 "mtime": mtime,
                 "outputs": generated_outputs
             }
+            if digest is not None:
+                entry["size"] = size
+                entry["digest"] = digest
+            if logseq_layer is not None:
+                entry["logseq"] = logseq_layer
+            self._share_payload(entry)
+            self.cache_data[file_path] = entry
+            self._index(generated_outputs)
+            self._index_digest(file_path, entry)
+            self._changed.add(file_path)
+            self._removed.discard(file_path)
+            return self._apply_diff(old_outputs, generated_outputs)
+
+    def touch_entry(self, file_path, mtime):
+        """内容未变、仅 mtime 变化时，只刷新缓存中的 mtime。"""
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.cache_data.get(file_path)
+            if entry is not None:
+                entry["mtime"] = mtime
+                self._changed.add(file_path)
 
     def remove_entry(self, file_path):
-        """从缓存中移除一个文件的条目。"""
+        """从缓存中移除一个文件的条目，返回发生成员变化的输出文件。"""
         with self.lock:
-            if file_path in self.cache_data:
-                del self.cache_data[file_path]
+            self._ensure_loaded()
+            if file_path not in self.cache_data:
+                return set()
+            old_outputs = self.cache_data[file_path].get("outputs", {})
+            self._unindex(old_outputs)
+            self._unindex_digest(file_path, self.cache_data[file_path])
+            del self.cache_data[file_path]
+            self._changed.discard(file_path)
+            self._removed.add(file_path)
+            return self._apply_diff(old_outputs, {})
+
+    def find_entry_by_digest(self, digest):
+        """返回任意一个内容摘要为 digest、且带完整解析层的缓存条目；没有时返回 None。"""
+        with self.lock:
+            self._ensure_loaded()
+            for path in self.digest_index.get(digest, ()):
+                return self.cache_data[path]
+            return None
 
     def get_all_cached_paths(self):
         """获取所有已缓存的文件路径列表。"""
         with self.lock:
+            self._ensure_loaded()
             return list(self.cache_data.keys())
 
-    def get_outputs_for_file(self, file_path):
-        """获取一个文件生成的所有输出文件及其条目。"""
+    def render_output(self, lib):
+        """输出某个词库当前的完整内容（已排序、去重）。"""
+        with self.lock:
+            self._ensure_loaded()
+            model = self.libraries.get(lib)
+            return model.render() if model else ""
+
+    def get_all_library_names(self):
+        """获取缓存中出现过的全部词库文件名（不含输出目录）。"""
         with self.lock:
-            entry = self.cache_data.get(file_path, {})
-            return entry.get("outputs", {})
+            self._ensure_loaded()
+            return list(self.library_refs)
+
+    def _apply_diff(self, old_outputs, new_outputs):
+        """只把新旧输出之间的差异行应用到词库模型上。"""
+        changed = set()
+        for out_path in old_outputs.keys() | new_outputs.keys():
+            old_content = old_outputs.get(out_path) or ""
+            new_content = new_outputs.get(out_path) or ""
+            if old_content == new_content:
+                continue
+            old_lines = set(old_content.splitlines())
+            new_lines = set(new_content.splitlines())
+            model = self.libraries.get(out_path)
+            if model is None:
+                model = self.libraries[out_path] = LibraryModel()
+            is_changed = False
+            for line in old_lines - new_lines:
+                is_changed = model.discard(line) or is_changed
+            for line in new_lines - old_lines:
+                is_changed = model.add(line) or is_changed
+            if not model:
+                del self.libraries[out_path]
+            if is_changed:
+                changed.add(out_path)
+        return changed
+
+    def _migrate_output_keys(self):
+        """
+        旧版缓存以绝对路径 (输出目录/词库名) 作为输出键；现在统一只保存词库名，
+        输出目录在写出时再拼接，因此更换输出目录无需重新解析。
+        """
+        for file_path, entry in self.cache_data.items():
+            outputs = entry.get("outputs", {})
+            if all(os.path.basename(k) == k for k in outputs):
+                continue
+            migrated = {}
+            for out_path, content in outputs.items():
+                lib = os.path.basename(out_path)
+                if lib in migrated and migrated[lib]:
+                    lines = dict.fromkeys(migrated[lib].splitlines())
+                    lines.update(dict.fromkeys((content or "").splitlines()))
+                    content = "\n".join(lines)
+                migrated[lib] = content
+            entry["outputs"] = migrated
+            self._changed.add(file_path)
+
+    def _rebuild_libraries(self):
+        self.libraries = {}
+        for entry in self.cache_data.values():
+            self._apply_diff({}, entry.get("outputs", {}))
+
+    def _index(self, outputs):
+        self.library_refs.update(outputs.keys())
+
+    def _unindex(self, outputs):
+        for lib in outputs:
+            self.library_refs[lib] -= 1
+            if self.library_refs[lib] <= 0:
+                del self.library_refs[lib]
+
+    @staticmethod
+    def _digest_of(entry):
+        # 只有带 Logseq 原始层的条目才包含完整的解析结果，可以被其他文件复用
+        return entry.get("digest") if "logseq" in entry else None
+
+    def _index_digest(self, file_path, entry):
+        digest = self._digest_of(entry)
+        if digest is not None:
+            self.digest_index.setdefault(digest, set()).add(file_path)
+
+    def _unindex_digest(self, file_path, entry):
+        digest = self._digest_of(entry)
+        paths = self.digest_index.get(digest)
+        if paths is None:
+            return
+        paths.discard(file_path)
+        if not paths:
+            del self.digest_index[digest]
+
+    def _rebuild_digest_index(self):
+        self.digest_index = {}
+        for file_path, entry in self.cache_data.items():
+            self._index_digest(file_path, entry)
+
+    def _share_payload(self, entry):
+        """内容相同的文件共用同一份输出与属性层对象：内存中只保留一份，SQLite 后端也只存一份。"""
+        for path in self.digest_index.get(self._digest_of(entry), ()):
+            other = self.cache_data[path]
+            if other["outputs"] == entry["outputs"]:
+                entry["outputs"] = other["outputs"]
+            if other["logseq"] == entry["logseq"]:
+                entry["logseq"] = other["logseq"]
+            return
+
+    def _rebuild_index(self):
+        self.library_refs = collections.Counter()
+        for entry in self.cache_data.values():
+            self._index(entry.get("outputs", {}))
@@ -27,7 +27,17 @@ class ConfigManager:
                 "logseq_scan_values": False,
                 "run_on_startup": False,
                 "minimize_to_tray": True,
-                "auto_generate": True
+                "auto_generate": True,
+                # 解析缓存后端："sqlite"（增量写入，默认）或 "json"（旧版单文件）
+                "cache_backend": "sqlite",
+                # 全量解析引擎："auto"（大批量自动启用多进程）、"thread" 或 "process"
+                "parse_engine": "auto",
+                # 热更新延迟目标（秒）：单次保存在约一半目标时间后处理；持续写入的文件最多等待 debounce_max_delay 秒
+                "debounce_latency_target": 0.5,
+                "debounce_max_delay": 10.0,
+                # 词库写出：是否把文件和目录刷入磁盘；是否整批写出（任一失败则全部保持旧版本）
+                "output_fsync": False,
+                "output_all_or_nothing": False
             },
             "output_selection": {},
             "window_geometry": ""
@@ -0,0 +1,260 @@
+# app_logic/incremental_parser.py
+# 大文件热保存的增量解析：按行对比新旧内容，只重解析受影响的顶层大纲块
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+
+from src.logic.ast_parser import AstParser
+
+_INF = float('inf')
+_EMPTY = {}
+_RUN_CHUNK = 256
+# 全部保留状态的原文总字符数上限；每份状态还包含处理后的行和块结果，实际内存约为其数倍
+MAX_CACHED_CHARS = 32 * 1024 * 1024
+
+
+def _common_run(a, b, i, j, limit, step):
+    """从 a[i]、b[j] 起按 step 方向逐行比较，返回相同行的个数（至多 limit）；整块切片比较以减少解释器循环。"""
+    n = 0
+    while limit - n >= _RUN_CHUNK:
+        if step > 0:
+            same = a[i + n:i + n + _RUN_CHUNK] == b[j + n:j + n + _RUN_CHUNK]
+        else:
+            same = a[i - n - _RUN_CHUNK + 1:i - n + 1] == b[j - n - _RUN_CHUNK + 1:j - n + 1]
+        if not same:
+            break
+        n += _RUN_CHUNK
+    while n < limit and a[i + n * step] == b[j + n * step]:
+        n += 1
+    return n
+
+
+class _Block:
+    """
+    一个顶层大纲块：从块首行（缩进不大于此前所有行）到下一个块首行之前的所有原始行。
+
+    block_entries / single_entries 是该块单独解析得到的两阶段结果；
+    indents 是块内出现过的缩进集合；gaps 是块内每个节点与其父节点之间的缩进区间
+    (父缩进, 自身缩进)，只要此前的块没有缩进落在某个区间内，单独解析的结果就
+    与整篇解析完全一致。
+    """
+    __slots__ = ("start", "head_indent", "indents", "gaps", "block_entries", "single_entries")
+
+    def __init__(self, start, head_indent, indents, gaps, block_entries, single_entries):
+        self.start = start
+        self.head_indent = head_indent
+        self.indents = indents
+        self.gaps = gaps
+        self.block_entries = block_entries
+        self.single_entries = single_entries
+
+    def conflicts_with(self, earlier_indents) -> bool:
+        """此前的块若有缩进落在本块某个父子缩进区间内，节点就会挂到前面的块上。"""
+        return any(lo < j < hi for lo, hi in self.gaps for j in earlier_indents)
+
+
+class _FileState:
+    __slots__ = ("fingerprint", "raw", "processed", "blocks", "starts", "size")
+
+    def __init__(self, fingerprint, raw, processed, blocks):
+        self.size = 0               # 原文字符数，由 IncrementalParser 计入总量
+        self.fingerprint = fingerprint
+        self.raw = raw              # Tab 已标准化的原始行
+        self.processed = processed  # 与 raw 对齐的规则处理结果，被排除的行为 None
+        self.blocks = blocks
+        self.starts = [block.start for block in blocks]
+
+
+class IncrementalParser:
+    """
+    为最近编辑过的大文件保留解析状态（LRU），再次解析时与上一版本逐行对比，
+    只对改动所在的顶层块重新应用规则和建树，其余块的结果直接复用。
+    保留的状态同时受文件数和原文总字符数 (max_chars) 限制，单个超过 max_chars
+    的文件不保留状态，直接整篇解析。
+
+    结果与 AstParser.parse 完全一致；块之间存在“过期缩进”挂接、或改动导致后续
+    块的划分发生变化时回退到整篇解析。只在单个工作线程中使用，不加锁。
+    """
+    def __init__(self, max_files=16, min_lines=1000, metrics=None, max_chars=MAX_CACHED_CHARS):
+        self.max_files = max_files
+        self.min_lines = min_lines  # 行数太少的文件整篇解析更快，不保留状态
+        self.max_chars = max_chars
+        self.metrics = metrics
+        self.parser = AstParser()
+        self._states = OrderedDict()
+        self._total_chars = 0
+
+    def discard(self, key):
+        state = self._states.pop(key, None)
+        if state is not None:
+            self._total_chars -= state.size
+
+    def clear(self):
+        self._states.clear()
+        self._total_chars = 0
+
+    def _store(self, key, state, size):
+        """放入（或更新）一份状态，并按 LRU 淘汰到文件数与总字符数都在上限内。"""
+        self.discard(key)
+        state.size = size
+        self._states[key] = state
+        self._total_chars += size
+        while len(self._states) > self.max_files or self._total_chars > self.max_chars:
+            _, evicted = self._states.popitem(last=False)
+            self._total_chars -= evicted.size
+
+    def parse(self, key, text: str, rules) -> tuple[dict, list]:
+        """与 AstParser.parse 相同的返回值；key 通常为文件路径。"""
+        if len(text) > self.max_chars:
+            self.discard(key)
+            return self.parser.parse(text, rules=rules)
+        raw = text.replace('\t', '    ').split('\n')
+        if len(raw) < self.min_lines:
+            self.discard(key)
+            return self.parser.parse(text, rules=rules)
+
+        state = self._states.get(key)
+        if state is not None and state.fingerprint == rules.fingerprint and self._patch(state, raw, rules):
+            self._count("incremental_parses")
+        else:
+            state = self._build(raw, rules)
+            if state is None:
+                self.discard(key)
+                self._count("incremental_fallbacks")
+                return self.parser.parse(text, rules=rules)
+        self._store(key, state, len(text))
+        return self._compose(state.blocks), []
+
+    def _count(self, name):
+        if self.metrics is not None:
+            self.metrics.incr(name)
+
+    def _build(self, raw, rules):
+        """整篇切块解析；块之间不独立时返回 None。"""
+        processed = self._apply_rules(raw, rules)
+        blocks, _ = self._parse_region(processed, 0, len(processed), _INF)
+        earlier = set()
+        for block in blocks:
+            if block.conflicts_with(earlier):
+                return None
+            earlier |= block.indents
+        return _FileState(rules.fingerprint, raw, processed, blocks)
+
+    def _patch(self, state, raw, rules) -> bool:
+        """按公共前后缀定位改动，只重解析受影响的块；无法安全增量时返回 False。"""
+        old_raw, blocks, starts = state.raw, state.blocks, state.starts
+        n_old, n_new = len(old_raw), len(raw)
+        prefix = _common_run(old_raw, raw, 0, 0, min(n_old, n_new), 1)
+        if prefix == n_old == n_new:
+            return True
+        suffix = _common_run(old_raw, raw, n_old - 1, n_new - 1, min(n_old, n_new) - prefix, -1)
+
+        # 改动之前的那一行所在的块也要重解析：新插入的行可能属于它
+        first = bisect_right(starts, max(prefix - 1, 0)) - 1
+        last = bisect_right(starts, max(n_old - suffix - 1, prefix - 1, 0)) - 1
+        region_start = starts[first]
+        old_end = starts[last + 1] if last + 1 < len(starts) else n_old
+        delta = n_new - n_old
+
+        processed = state.processed[:prefix] + self._apply_rules(raw[prefix:n_new - suffix], rules) + state.processed[n_old - suffix:]
+
+        running_min = _INF
+        if first > 0 and blocks[first - 1].head_indent is not None:
+            running_min = blocks[first - 1].head_indent
+        new_blocks, running_min = self._parse_region(processed, region_start, old_end + delta, running_min)
+
+        # 改动改变了此后的最小缩进时，后续块的划分可能改变，直接整篇重建
+        if old_end < n_old:
+            old_min = blocks[last].head_indent
+            if running_min != (_INF if old_min is None else old_min):
+                return False
+
+        earlier = set()
+        for block in blocks[:first]:
+            earlier |= block.indents
+        old_after = set(earlier)
+        for block in blocks[first:last + 1]:
+            old_after |= block.indents
+        for block in new_blocks:
+            if block.conflicts_with(earlier):
+                return False
+            earlier |= block.indents
+        if earlier != old_after:
+            for block in blocks[last + 1:]:
+                if block.conflicts_with(earlier):
+                    return False
+                earlier |= block.indents
+
+        if delta:
+            for block in blocks[last + 1:]:
+                block.start += delta
+        blocks[first:last + 1] = new_blocks
+        state.raw, state.processed = raw, processed
+        state.starts = [block.start for block in blocks]
+        return True
+
+    @staticmethod
+    def _apply_rules(lines, rules):
+        if not rules.has_rules:
+            return lines
+        apply = rules.apply
+        return [apply(line) for line in lines]
+
+    def _parse_region(self, processed, start, end, running_min):
+        """把 [start, end) 切成顶层块并逐块解析，返回 (块列表, 区域结束时的最小缩进)。"""
+        bounds = [start]
+        heads = [None]
+        for i in range(start, end):
+            line = processed[i]
+            if line is None or not line.strip():
+                continue
+            indent = len(line) - len(line.lstrip(' \t'))
+            if indent <= running_min:
+                running_min = indent
+                if i == bounds[-1]:
+                    heads[-1] = indent
+                else:
+                    bounds.append(i)
+                    heads.append(indent)
+        bounds.append(end)
+
+        blocks = []
+        for k, head_indent in enumerate(heads):
+            lines = [line for line in processed[bounds[k]:bounds[k + 1]] if line is not None]
+            indents, gaps = self._indent_profile(lines)
+            if head_indent is None:
+                block_entries, single_entries = _EMPTY, _EMPTY
+            else:
+                block_entries, single_entries = self.parser.parse_lines(lines)
+            blocks.append(_Block(bounds[k], head_indent, indents, gaps, block_entries or _EMPTY, single_entries or _EMPTY))
+        return blocks, running_min
+
+    @staticmethod
+    def _indent_profile(lines):
+        """只追踪缩进：返回块内缩进集合，以及中间还能容纳其他缩进的父子缩进区间。"""
+        known_indents = [-1]
+        gaps = set()
+        for line in lines:
+            if not line.strip():
+                continue
+            indent = len(line) - len(line.lstrip(' \t'))
+            pos = bisect_left(known_indents, indent)
+            parent_indent = known_indents[pos - 1]
+            if parent_indent != -1 and indent - parent_indent > 1:
+                gaps.add((parent_indent, indent))
+            if pos == len(known_indents) or known_indents[pos] != indent:
+                known_indents.insert(pos, indent)
+        return frozenset(known_indents[1:]), tuple(gaps)
+
+    @staticmethod
+    def _compose(blocks):
+        kv_trees = defaultdict(list)
+        for block in blocks:
+            if block.block_entries:
+                for lib, entries in block.block_entries.items():
+                    kv_trees[lib].extend(entries)
+        for block in blocks:
+            if block.single_entries:
+                for lib, entries in block.single_entries.items():
+                    kv_trees[lib].extend(entries)
+        return {lib: list(dict.fromkeys(entries)) for lib, entries in kv_trees.items()}
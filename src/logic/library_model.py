@@ -0,0 +1,46 @@
+# app_logic/library_model.py
+# 单个输出词库的内存模型：按行维护贡献源的引用计数，支持增量增删
+
+import bisect
+
+class LibraryModel:
+    """
+    一个词库的行级引用计数模型。
+
+    counts 记录每一行被多少个源文件贡献，lines 始终保持有序，
+    因此增删若干行只需 O(变动行数) 次二分插入/删除，输出时无需再排序。
+    """
+    __slots__ = ("counts", "lines")
+
+    def __init__(self):
+        self.counts = {}
+        self.lines = []
+
+    def __len__(self):
+        return len(self.lines)
+
+    def add(self, line: str) -> bool:
+        """增加一次引用，若该行首次出现（成员变化）则返回 True。"""
+        count = self.counts.get(line, 0)
+        self.counts[line] = count + 1
+        if count:
+            return False
+        bisect.insort(self.lines, line)
+        return True
+
+    def discard(self, line: str) -> bool:
+        """减少一次引用，若该行因此被移除（成员变化）则返回 True。"""
+        count = self.counts.get(line, 0)
+        if count > 1:
+            self.counts[line] = count - 1
+            return False
+        if not count:
+            return False
+        del self.counts[line]
+        i = bisect.bisect_left(self.lines, line)
+        del self.lines[i]
+        return True
+
+    def render(self) -> str:
+        """按排序后的行输出完整词库内容。"""
+        return "\n".join(self.lines)
@@ -2,6 +2,29 @@
 # 专门用于解析 Logseq .md 文件页眉属性的模块
 
 import re
+from functools import lru_cache
+
+# 匹配 "key::" 格式，支持前面带 "- " 缩进；一次匹配同时取得键名和 :: 之后的内容
+PROPERTY_PATTERN = re.compile(r'^\s*(?:-\s*)?([^\s:]+)::(.*)', re.S)
+# 匹配 "[[value]]" 格式
+VALUE_PATTERN = re.compile(r'\[\[(.*?)\]\]')
+BRACKET_PATTERN = re.compile(r'\[\[.*?\]\]')
+# 纯文本值中多个词条的分隔符，比如 alias:: QK, QKV
+PURE_VALUE_SEPARATORS = re.compile(r'[,，、;；]')
+
+
+@lru_cache(maxsize=8)
+def _compile_exclusions(exclude_keys: frozenset):
+    """
+    把排除键拆成精确匹配集合和一个前缀匹配函数（所有 "前缀*" 合并成一个预编译的“或”正则），
+    每行只需一次集合查找和一次正则匹配，不再逐个遍历排除键。
+    按键集合缓存，同一批文件共用一份。
+    """
+    exact = frozenset(ex for ex in exclude_keys if not ex.endswith('*'))
+    prefixes = sorted({ex[:-1] for ex in exclude_keys if ex.endswith('*')})
+    prefix_match = re.compile('|'.join(map(re.escape, prefixes))).match if prefixes else None
+    return exact, prefix_match
+
 
 class LogseqParser:
     def __init__(self, scan_keys=False, scan_values=False, scan_pure_values=False, exclude_keys=None):
@@ -16,10 +39,10 @@ class LogseqParser:
         self.scan_values = scan_values
         self.scan_pure_values = scan_pure_values
         self.exclude_keys = set(exclude_keys) if exclude_keys else set()
-        # 匹配 "key::" 格式，支持前面带 "- " 缩进
-        self.key_pattern = re.compile(r'^\s*(?:-\s*)?([^\s:]+)::')
-        # 匹配 "[[value]]" 格式
-        self.value_pattern = re.compile(r'\[\[(.*?)\]\]')
+        # 精确键用集合查找，"card-*" 这类前缀键合并为一个正则
+        self._exact_excludes, self._prefix_exclude = _compile_exclusions(frozenset(self.exclude_keys))
+        self.key_pattern = PROPERTY_PATTERN
+        self.value_pattern = VALUE_PATTERN
 
     def parse_file_content(self, content: str) -> list[str]:
         """
@@ -27,78 +50,78 @@ class LogseqParser:
         :param content: 文件的完整内容字符串。
         :return: 从文件中提取的词条列表。
         """
-        if not self.scan_keys and not self.scan_values and getattr(self, 'scan_pure_values', False) is False:
+        if not self.scan_keys and not self.scan_values and not self.scan_pure_values:
             return []
+        return self.compose(self.extract_properties(content))
 
-        entries = set()
-        lines = content.splitlines()
+    @staticmethod
+    def extract_properties(content: str) -> dict:
+        """
+        提取与扫描选项、排除键都无关的原始属性层：{键: [[双括号值...], [纯文本值...]]}。
+        结果可以直接缓存，切换选项或修改排除键时用 compose 重新组合即可，无需重读文件。
+        """
+        layer = {}
+        for line in content.splitlines():
+            # 扫描整个文件，而不仅仅是页眉：不在遇到非属性行时中断
+            if '::' in line:
+                LogseqParser._collect_line(line, layer)
+        return LogseqParser.finish_layer(layer)
 
+    @staticmethod
+    def tap_lines(lines, layer: dict):
+        """
+        流式解析用：原样透传逐行读取的内容，同时把原始属性收集到 layer，
+        这样 AST 与 Logseq 共用同一次读取。收集完后用 finish_layer 整理，
+        结果与 extract_properties 一致。
+        """
         for line in lines:
-            # 现在我们需要扫描整个文件，而不是仅仅扫描头部。
-            # 因此，我们将移除原来用于在遇到非属性行时中断扫描的逻辑。
-            
-            # 检查行中是否包含属性分隔符 '::'
-            is_property_line = '::' in line
-            
-            if not is_property_line:
-                # 如果当前行不是属性行，则跳过，继续检查下一行。
-                continue
+            if '::' in line:
+                # 与 splitlines 保持一致：\v、\f 等字符在整篇解析时同样是行分隔符
+                for part in line.splitlines():
+                    LogseqParser._collect_line(part, layer)
+            yield line
 
-            # 检查当前行是否包含任何黑名单里的键（支持精确匹配和前缀匹配）
-            skip_line = False
-            key_match = self.key_pattern.match(line)
-            if not key_match:
-                # :: 前没有有效键名（空格或空），跳过这种畸形行
-                continue
-            
-            line_key = key_match.group(1)
-            for ex in self.exclude_keys:
-                if ex.endswith('*'):
-                    # 前缀匹配模式：card-* 匹配所有以 card- 开头的键
-                    prefix = ex[:-1]
-                    if line_key.startswith(prefix):
-                        skip_line = True
-                        break
-                else:
-                    # 精确匹配模式
-                    if line_key == ex:
-                        skip_line = True
-                        break
-                    
-            if skip_line:
-                continue
+    @staticmethod
+    def finish_layer(layer: dict) -> dict:
+        """把收集中的集合整理为排好序的列表，便于缓存和比较。"""
+        return {key: [sorted(values), sorted(pure_values)] for key, (values, pure_values) in layer.items()}
 
-            # 提取属性键
-            if self.scan_keys:
-                # 查找所有 "key::"
-                found_keys = re.findall(self.key_pattern, line)
-                for key in found_keys:
-                    entries.add(f"- {key.strip()}::")
+    @staticmethod
+    def _collect_line(line: str, layer: dict):
+        """解析单行，把键、双括号值和纯文本值一起并入 layer。一行只做一次属性匹配。"""
+        match = PROPERTY_PATTERN.match(line)
+        if not match:
+            # 不是属性行，或 :: 前没有有效键名（空格或空），跳过
+            return
+
+        key, rest = match.groups()
+        values, pure_values = layer.setdefault(key, (set(), set()))
+        # [[ ]] 可能出现在键名里，因此在整行上查找
+        values.update(VALUE_PATTERN.findall(line))
+        # :: 后面的纯文本：去掉 [[ ]] 部分以免与双括号值重复，再按分隔符切成多个词条
+        pure_val = BRACKET_PATTERN.sub('', rest.strip()).strip()
+        for c in PURE_VALUE_SEPARATORS.split(pure_val):
+            c = c.strip()
+            if c:
+                pure_values.add(c)
 
-            # 提取属性值
+    def is_excluded(self, key: str) -> bool:
+        """键是否命中黑名单（支持精确匹配和 "前缀*" 匹配）。"""
+        if key in self._exact_excludes:
+            return True
+        return self._prefix_exclude is not None and self._prefix_exclude(key) is not None
+
+    def compose(self, layer: dict) -> list[str]:
+        """按当前扫描选项和排除键，把原始属性层组合成有序的词条列表。"""
+        entries = set()
+        for key, (values, pure_values) in layer.items():
+            # 碰到排除键时整行跳过，不提取键也不提取值
+            if self.is_excluded(key):
+                continue
+            if self.scan_keys:
+                entries.add(f"- {key}::")
             if self.scan_values:
-                # 查找所有 "[[value]]"
-                found_values = self.value_pattern.findall(line)
-                for value in found_values:
-                    entries.add(f"- [[{value}]]")
-                    
-            if getattr(self, 'scan_pure_values', False):
-                # 提取 :: 后面的所有纯文本（去除可能的 [[]] 内容以防重复，这里简单抽取）
-                # 按照用户需求：如 "属性键:: 值"，提取 "值"
-                # 先分割得到 :: 后面的部分
-                parts = line.split("::", 1)
-                if len(parts) > 1:
-                    raw_val = parts[1].strip()
-                    # 把带方括号的移除掉，避免在这项里提取出来
-                    pure_val = re.sub(r'\[\[.*?\]\]', '', raw_val).strip()
-                    # 如果还有剩余非空字符，则作为一个词条
-                    
-                    # 按照逗号、中文逗号等可能的分隔符切分支持多词条并置情况
-                    # 比如 alias:: QK, QKV
-                    candidates = re.split(r'[,，、;；]', pure_val)
-                    for c in candidates:
-                        c = c.strip()
-                        if c:
-                            entries.add(f"- {c}")
-        
-        return sorted(list(entries))
\ No newline at end of file
+                entries.update(f"- [[{value}]]" for value in values)
+            if self.scan_pure_values:
+                entries.update(f"- {c}" for c in pure_values)
+        return sorted(entries)
@@ -0,0 +1,282 @@
+# app_logic/rule_set.py
+# 预编译、带指纹的清洗规则集：规则变化时构建一次，在所有文件、线程和进程间复用
+
+import hashlib
+import json
+import re
+from bisect import bisect_right
+from difflib import SequenceMatcher
+
+TAG_MARKER = "#KV树".encode("utf-8")
+# 标签中最稀有的字符；除非替换内容本身包含它，否则任何改写规则都无法凭空造出它
+TAG_MARKER_CHAR = "树".encode("utf-8")
+
+# 这些写法在合并为一个大的“或”正则后语义会改变（分组编号偏移、全局标志位置等），不参与合并
+_UNFUSABLE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|^\(\?[aiLmsux]+\)')
+
+
+class CompiledRuleSet:
+    """
+    不可变的已编译规则集。
+
+    line_stages 按原顺序保存“排除行”规则：连续的纯删除行规则被合并成一次正则
+    搜索 ("drop", pattern)，带替换的行规则保持为 ("replace", pattern, repl)。
+    content_rules 为 (pattern, repl) 元组。fingerprint 唯一标识规则内容，
+    可用于缓存键或判断规则是否变化。
+    """
+    __slots__ = ("line_stages", "content_rules", "fingerprint", "tag_marker", "has_rules")
+
+    def __init__(self, line_stages, content_rules, fingerprint, tag_marker, has_rules):
+        object.__setattr__(self, "line_stages", line_stages)
+        object.__setattr__(self, "content_rules", content_rules)
+        object.__setattr__(self, "fingerprint", fingerprint)
+        object.__setattr__(self, "tag_marker", tag_marker)
+        object.__setattr__(self, "has_rules", has_rules)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledRuleSet is immutable")
+
+    def __reduce__(self):
+        # 供进程池 initializer 传输：正则对象在子进程中按 pattern 重新编译
+        return (CompiledRuleSet, (self.line_stages, self.content_rules, self.fingerprint, self.tag_marker, self.has_rules))
+
+    def __repr__(self):
+        return f"CompiledRuleSet(fingerprint={self.fingerprint[:12]}, stages={len(self.line_stages)}, content={len(self.content_rules)})"
+
+    @classmethod
+    def from_rules(cls, rules):
+        """由 AppState 的规则字典 {"line_rules": [...], "content_rules": [...]} 构建。"""
+        if not rules or not isinstance(rules, dict):
+            return cls((), (), _fingerprint(None), TAG_MARKER, False)
+
+        line_rules = rules.get("line_rules", [])
+        content_rules = rules.get("content_rules", [])
+
+        stages = []
+        pending_drops = []  # 当前连续的纯删除规则 (源码, 已编译)
+
+        def _flush_drops():
+            fusable = [src for src, _ in pending_drops if not _UNFUSABLE.search(src)]
+            if len(fusable) > 1:
+                try:
+                    fused = re.compile("|".join(f"(?:{src})" for src in fusable))
+                except re.error:
+                    fused = None
+                if fused is not None:
+                    stages.append(("drop", fused))
+                    stages.extend(("drop", p) for src, p in pending_drops if _UNFUSABLE.search(src))
+                    pending_drops.clear()
+                    return
+            stages.extend(("drop", p) for _, p in pending_drops)
+            pending_drops.clear()
+
+        for r in line_rules:
+            try:
+                pattern = re.compile(r.get("match", ""))
+            except Exception:
+                continue
+            repl = r.get("replace", "")
+            if not repl:
+                pending_drops.append((r.get("match", ""), pattern))
+            else:
+                _flush_drops()
+                stages.append(("replace", pattern, repl))
+        _flush_drops()
+
+        compiled_content = []
+        for r in content_rules:
+            try:
+                compiled_content.append((re.compile(r.get("match", "")), r.get("replace", "")))
+            except Exception:
+                pass
+
+        return cls(tuple(stages), tuple(compiled_content), _fingerprint(rules),
+                   _tag_marker(line_rules, content_rules), True)
+
+    def apply(self, line):
+        """对单行执行全部规则，返回处理后的行；若该行应被整行排除则返回 None。"""
+        # 1. 优先执行“排除行”规则
+        for stage in self.line_stages:
+            if stage[1].search(line):
+                if stage[0] == "drop":
+                    return None
+                line = stage[1].sub(stage[2], line)
+        # 2. 执行“排除内容”规则
+        for pattern, repl in self.content_rules:
+            line = pattern.sub(repl, line)
+        return line
+
+
+def _fingerprint(rules):
+    payload = json.dumps(rules, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _tag_marker(line_rules, content_rules):
+    """
+    文件原始字节中必须包含的标记，否则经过规则处理后也不可能出现 KV 标签；
+    返回 None 表示不存在安全的标记。改写规则可能通过删除中间文本把 '#KV' 和 '树'
+    拼接起来，因此存在改写规则时只能检查标记的最后一个字符。
+    """
+    rewrites = list(content_rules) + [r for r in line_rules if r.get("replace")]
+    if any("树" in r.get("replace", "") for r in rewrites):
+        return None
+    return TAG_MARKER_CHAR if rewrites else TAG_MARKER
+
+
+# 含这些写法的正则在整篇文本（re.M）上匹配与逐行匹配可能不一致：前后断言会看到相邻行，
+# \A \Z 只认整篇首尾，(?-m: 会关掉多行模式。这类正则只能逐行检查
+_LINE_BOUND = re.compile(r'\\[AZ]|\(\?<?[=!]|\(\?[a-zA-Z]*-')
+
+
+def _rule_steps(rules):
+    """把规则字典展开为按执行顺序排列的 (类型, 正则源码, 替换) 序列，无法编译的规则与 from_rules 一样跳过。"""
+    if not rules or not isinstance(rules, dict):
+        return []
+    steps = []
+    for kind in ("line", "content"):
+        for r in rules.get(f"{kind}_rules", []):
+            src = r.get("match", "")
+            try:
+                re.compile(src)
+            except Exception:
+                continue
+            steps.append((kind, src, r.get("replace", "")))
+    return steps
+
+
+class _Document:
+    """一个文件 Tab 已标准化的全文；行列表和行首偏移只在需要时计算。"""
+    __slots__ = ("text", "_lines", "_starts")
+
+    def __init__(self, text):
+        self.text = text
+        self._lines = None
+        self._starts = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.text.split('\n')
+        return self._lines
+
+    def line_range(self, start, end):
+        """整篇文本中 [start, end) 这段跨过的行号。"""
+        if self._starts is None:
+            self._starts = [0] + [m.end() for m in re.finditer('\n', self.text)]
+        first = bisect_right(self._starts, start) - 1
+        last = bisect_right(self._starts, max(end - 1, start)) - 1
+        return range(first, last + 1)
+
+
+class _Matcher:
+    """同一条正则的逐行版本和整篇版本；整篇版本一次搜索即可代替逐行循环。"""
+    __slots__ = ("pattern", "whole")
+
+    def __init__(self, src):
+        self.pattern = re.compile(src)
+        self.whole = None
+        if not _LINE_BOUND.search(src):
+            try:
+                self.whole = re.compile(src, re.M)
+            except re.error:
+                pass
+
+    def found_in(self, doc) -> bool:
+        """是否可能在某一行上命中（整篇搜索是逐行结果的超集）。"""
+        if self.whole is not None:
+            return self.whole.search(doc.text) is not None
+        return any(map(self.pattern.search, doc.lines))
+
+    def hit_lines(self, doc) -> set:
+        """
+        包含所有逐行命中的行号集合（可能多出几行）。整篇匹配可能跨行并吞掉后面行
+        自己的匹配，所以把每个匹配跨过的行都算上。
+        """
+        if self.whole is None:
+            search = self.pattern.search
+            return {i for i, line in enumerate(doc.lines) if search(line)}
+        hit = set()
+        for m in self.whole.finditer(doc.text):
+            hit.update(doc.line_range(m.start(), m.end()))
+        return hit
+
+
+class _Probe:
+    """规则序列 steps 中第 k 条规则：判断它在该序列里是否可能对某个文件的某一行生效。"""
+    __slots__ = ("matcher", "rewrites", "whole_rewrite", "prefix")
+
+    def __init__(self, steps, k):
+        self.matcher = _Matcher(steps[k][1])
+        before = steps[:k]
+        # 排在前面、会改写行内容的规则 (匹配器, 替换)；纯删除的行规则只会让行消失，忽略它们是保守的
+        self.rewrites = [(_Matcher(src), repl) for kind, src, repl in before if kind == "content" or repl]
+        # 改写规则都能整篇匹配、替换又是不含换行的纯文本时，可以直接在整篇文本上依次替换
+        self.whole_rewrite = all(m.whole is not None and '\\' not in repl and '\n' not in repl
+                                 for m, repl in self.rewrites)
+        self.prefix = CompiledRuleSet.from_rules({
+            "line_rules": [{"match": src, "replace": repl} for kind, src, repl in before if kind == "line"],
+            "content_rules": [{"match": src, "replace": repl} for kind, src, repl in before if kind == "content"],
+        })
+
+    def may_fire(self, doc) -> bool:
+        if self.matcher.found_in(doc):
+            return True
+        if not self.rewrites:
+            return False
+        if self.whole_rewrite:
+            rewritten = self._rewrite_whole(doc.text)
+            if rewritten is not None:
+                return self.matcher.found_in(_Document(rewritten))
+        # 原文没有命中时，只有被前面的改写规则改过的行才可能在轮到本规则时命中；
+        # 没被任何改写规则命中的行原样到达本规则，上面已经排除。对这些行精确执行前缀规则
+        touched = set()
+        for rewrite, _ in self.rewrites:
+            touched |= rewrite.hit_lines(doc)
+        lines, apply, search = doc.lines, self.prefix.apply, self.matcher.pattern.search
+        for i in touched:
+            line = apply(lines[i])
+            if line is not None and search(line):
+                return True
+        return False
+
+    def _rewrite_whole(self, text):
+        """
+        在整篇文本上依次执行改写规则（不执行整行删除，保守）。只要没有匹配跨行，结果就与
+        逐行执行后再拼接相同；替换不含换行，所以换行数不变即说明没有跨行匹配，否则返回 None。
+        """
+        newlines = text.count('\n')
+        for rewrite, repl in self.rewrites:
+            text = rewrite.whole.sub(repl, text)
+        return text if text.count('\n') == newlines else None
+
+
+class RuleChange:
+    """
+    规则修改的影响分析：找出可能因新旧规则不同而得到不同结果的文件，只重解析它们。
+
+    新旧规则各自展开为执行顺序的序列，按最长公共子序列对齐；对不上的规则（删除、
+    新增、修改或挪动位置）记为差异规则。去掉差异规则后两边的序列完全相同，而一条
+    规则在某行上没有命中时就等于不存在，所以只要没有任何差异规则能在文件的某一行
+    上命中（各自在所属的新或旧序列里判断），新旧规则对该文件的处理结果就逐行相同。
+    """
+    __slots__ = ("probes",)
+
+    def __init__(self, old_rules, new_rules):
+        old_steps, new_steps = _rule_steps(old_rules), _rule_steps(new_rules)
+        self.probes = []
+        opcodes = SequenceMatcher(None, old_steps, new_steps, autojunk=False).get_opcodes()
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag != "equal":
+                self.probes.extend(_Probe(old_steps, k) for k in range(i1, i2))
+                self.probes.extend(_Probe(new_steps, k) for k in range(j1, j2))
+
+    @property
+    def is_noop(self) -> bool:
+        """规则实际没有变化（例如只是保存了一次或改了无法编译的规则）。"""
+        return not self.probes
+
+    def affects(self, text: str) -> bool:
+        """text 为文件解码后的全文；返回 False 表示新旧规则对它的处理结果必然相同。"""
+        doc = _Document(text.replace('\t', '    '))
+        return any(probe.may_fire(doc) for probe in self.probes)
@@ -377,10 +377,10 @@ class KvTreeAppUI(tk.Tk):
         if hasattr(self, 'trigger_save_cb'): self.trigger_save_cb()
     
     def _debounced_rebuild(self):
-        """防抖回调：静默触发重建，使用 full_rescan 而非 clear_cache 避免删除缓存文件"""
+        """防抖回调：扫描选项只影响输出的组合方式，直接用缓存的解析结果重新组合，不重读任何文件"""
         self._rebuild_timer_id = None
         self.set_status("正在后台重建词库（选项变更）...")
-        self.dispatcher.put_task(("full_rescan",))
+        self.dispatcher.put_task(("recompose_outputs",))
 
     def clear_personal_data(self):
         msg = "这将清除您勾选的个人数据，重置软件。\n\n• 您的源 .md 笔记文件【绝不】受影响。\n• 清除后软件将立即退出，需要您手动重新打开。\n\n确认清除吗？"
@@ -388,19 +388,18 @@ class KvTreeAppUI(tk.Tk):
             self.app_state.skip_save = True
             data_dir = os.path.abspath("用户数据")
             config_path = os.path.join(data_dir, "kv_tree_config.json")
-            cache_path = os.path.join(data_dir, "parsing_cache.json")
+            cache_manager = self.dispatcher.cache_manager
             
             try:
                 if self.clear_config_var.get() and os.path.exists(config_path):
                     os.remove(config_path)
-                    if os.path.exists(cache_path):
-                        os.remove(cache_path) # Force wipe cache to clear old absolute paths
+                    cache_manager.wipe() # Force wipe cache to clear old absolute paths
                     self.app_state.set_output_path("")
                     self.app_state.set_rules({"line_rules": [], "content_rules": []})
                     self.update_o_table()
                     
-                if self.clear_cache_var.get() and os.path.exists(cache_path):
-                    os.remove(cache_path)
+                if self.clear_cache_var.get():
+                    cache_manager.wipe()
                 if self.clear_output_var.get():
                     import stat
                     for f in self.app_state.get_active_outputs().keys():
@@ -526,9 +525,8 @@ class KvTreeAppUI(tk.Tk):
                 
         # 3. Scan the entire cache for historical/lazy outputs
         # Note: AppState handles cache mapping via ActiveOutputs now, but looking at raw cache gives absolute everything
-        for src, entry in self.dispatcher.cache_manager.cache_data.items():
-            for out_p in entry.get("outputs", {}).keys():
-                all_possible_basenames.add(os.path.basename(out_p))
+        for lib in self.dispatcher.cache_manager.get_all_library_names():
+            all_possible_basenames.add(lib)
                 
         dialog = BlacklistWindow(self, all_possible_basenames, self.app_state.get_blacklist)
         saved, new_blacklist = dialog.show()
@@ -551,8 +549,8 @@ class KvTreeAppUI(tk.Tk):
         if saved_items is not None:
             if saved_items != current_rules:
                 self.app_state.set_rules(saved_items)
-                if messagebox.askyesno("更新", "数据清洗清洗已修改，是否立即全量重建跑一遍新规则？"):
-                    self.dispatcher.put_task(("clear_cache",))
+                # 只重解析可能受新旧规则差异影响的文件，通常远快于全量重建，无需再询问
+                self.dispatcher.put_task(("apply_rule_change", current_rules))
 
     def manage_logseq_excludes(self):
         current_keys = self.app_state.get_logseq_exclude_keys()
@@ -569,8 +567,8 @@ class KvTreeAppUI(tk.Tk):
         if saved_items is not None:
             if saved_items != current_keys:
                 self.app_state.set_logseq_exclude_keys(saved_items)
-                if messagebox.askyesno("更新", "Logseq 排除属性已修改，是否立即全量重建词库？"):
-                    self.dispatcher.put_task(("clear_cache",))
+                # 排除键在组合输出时才生效，从缓存重新组合即可，无需重新解析
+                self.dispatcher.put_task(("recompose_outputs",))
 
     def update_generated_list(self):
         self.g_tree.delete(*self.g_tree.get_children())
@@ -692,7 +690,8 @@ class KvTreeAppUI(tk.Tk):
         if p: 
             self.app_state.set_output_path(p)
             self.update_o_table()
-            self.dispatcher.put_task(("full_rescan",))
+            # Cached outputs are independent of the folder: only the files need to be written again
+            self.dispatcher.put_task(("rewrite_outputs",))
 
     def toggle_mon(self):
         is_auto = self.auto_generate.get()
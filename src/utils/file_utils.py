@@ -1,12 +1,19 @@
+import concurrent.futures
+import hashlib
 import os
+import shutil
 import stat
 import tempfile
 
-def atomic_write(filepath, content, encoding="utf-8"):
-    """
-    Safely writes content to filepath using a temporary file and atomic replace.
-    Prevents truncation and 0-byte files if process is interrupted.
-    """
+# Directories holding fewer tracked files than this are stat'ed file by file:
+# listing a large folder to find one or two notes costs more than it saves
+SCANDIR_MIN_FILES = 4
+# Only Windows fills DirEntry stat results from the directory listing itself;
+# elsewhere DirEntry.stat() is one more syscall per file, no cheaper than os.stat
+SCANDIR_HAS_STAT = os.name == "nt"
+
+def _write_temp(filepath, content, encoding="utf-8", fsync=False):
+    """Writes content to a new temp file next to filepath and returns the temp path."""
     # Create temp file in the same directory to ensure they are on the same filesystem
     dir_name = os.path.dirname(filepath)
     if dir_name and not os.path.exists(dir_name):
@@ -17,27 +24,295 @@ def atomic_write(filepath, content, encoding="utf-8"):
     try:
         with os.fdopen(fd, 'w', encoding=encoding) as f:
             f.write(content)
-            
-        # If target file exists and is read-only, we must change its permissions first
-        if os.path.exists(filepath):
-            try:
-                os.chmod(filepath, stat.S_IWRITE)
-            except Exception:
-                pass # Best effort
-                
-        # Atomic replace
-        os.replace(tmp_path, filepath)
-        
-        # Set file to read-only as per application logic
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+    except Exception:
+        _remove_quietly(tmp_path)
+        raise
+    return tmp_path
+
+def _make_writable(filepath):
+    # If target file exists and is read-only, we must change its permissions first
+    if os.path.exists(filepath):
         try:
-            os.chmod(filepath, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+            os.chmod(filepath, stat.S_IWRITE)
         except Exception:
             pass # Best effort
+
+def _make_readonly(filepath):
+    # Set file to read-only as per application logic
+    try:
+        os.chmod(filepath, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+    except Exception:
+        pass # Best effort
+
+def _remove_quietly(path):
+    if os.path.exists(path):
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+
+def _fsync_directory(dir_name):
+    """Persists the renames in a directory; directories cannot be opened for this on Windows."""
+    if os.name == "nt":
+        return
+    fd = os.open(dir_name or os.curdir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(filepath, content, encoding="utf-8"):
+    """
+    Safely writes content to filepath using a temporary file and atomic replace.
+    Prevents truncation and 0-byte files if process is interrupted.
+    """
+    tmp_path = _write_temp(filepath, content, encoding)
+    try:
+        _make_writable(filepath)
+        # Atomic replace
+        os.replace(tmp_path, filepath)
+        _make_readonly(filepath)
     except Exception as e:
         # Cleanup temp file on failure
-        if os.path.exists(tmp_path):
+        _remove_quietly(tmp_path)
+        raise e
+
+def commit_files(writes, removes=(), fsync=False, all_or_nothing=False, encoding="utf-8", max_workers=8):
+    """
+    Writes many files as one batch. writes is [(filepath, render)] where
+    render() returns the content; removes lists files to delete.
+
+    Contents are rendered and written to temp files concurrently, then every
+    temp file is renamed over its target in one tight loop (read-only targets
+    are made writable first and read-only again afterwards). With fsync, each
+    temp file is flushed to disk before the renames and each directory once
+    after them.
+
+    Without all_or_nothing, files are independent: returns [(filepath, error)]
+    for the writes and removes that failed. With all_or_nothing, nothing is
+    renamed unless every file was written, and a rename or removal failing
+    half-way restores the previous files before the error is raised, so a
+    reader never sees a mix of old and new files once the batch is over.
+    """
+    writes = list(writes)
+    failed = []
+    temps = {}
+
+    def prepare(filepath, render):
+        return _write_temp(filepath, render(), encoding, fsync)
+
+    if writes:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(writes))) as executor:
+            futures = {executor.submit(prepare, filepath, render): filepath for filepath, render in writes}
+            for future in concurrent.futures.as_completed(futures):
+                filepath = futures[future]
+                try:
+                    temps[filepath] = future.result()
+                except Exception as e:
+                    failed.append((filepath, e))
+
+    if all_or_nothing:
+        if failed:
+            for tmp_path in temps.values():
+                _remove_quietly(tmp_path)
+            raise failed[0][1]
+        _commit_all_or_nothing(temps, removes)
+        failed = []
+    else:
+        for filepath, tmp_path in temps.items():
+            try:
+                _make_writable(filepath)
+                os.replace(tmp_path, filepath)
+                _make_readonly(filepath)
+            except Exception as e:
+                _remove_quietly(tmp_path)
+                failed.append((filepath, e))
+        for filepath in removes:
+            if os.path.exists(filepath):
+                try:
+                    _make_writable(filepath)
+                    os.remove(filepath)
+                except Exception as e:
+                    failed.append((filepath, e))
+
+    if fsync:
+        for dir_name in {os.path.dirname(filepath) for filepath in list(temps) + list(removes)}:
+            try:
+                _fsync_directory(dir_name)
+            except OSError as e:
+                failed.append((dir_name, e))
+    return failed
+
+def _backup(filepath):
+    """
+    Keeps the current content of filepath at filepath + ".bak_tmp" without
+    moving the file itself: a hard link, or a copy where links are unsupported.
+    """
+    backup = filepath + ".bak_tmp"
+    _remove_backup(backup) # Left over from an interrupted commit
+    try:
+        os.link(filepath, backup)
+    except OSError:
+        shutil.copy2(filepath, backup)
+    return backup
+
+def _remove_backup(backup):
+    _make_writable(backup)
+    _remove_quietly(backup)
+
+def _commit_all_or_nothing(temps, removes):
+    """
+    Renames temps over their targets; on any failure every target is restored from its backup.
+    Each target is backed up in place first, so it is replaced by a single atomic
+    rename and never briefly missing.
+    """
+    done = []  # (filepath, backup_path or None) for targets already replaced or removed
+    current = backup = None
+    try:
+        for filepath in [path for path in removes if os.path.exists(path)]:
+            current, backup = filepath, _backup(filepath)
+            _make_writable(filepath)
+            os.remove(filepath)
+            done.append((filepath, backup))
+            current = backup = None
+        for filepath, tmp_path in temps.items():
+            current, backup = filepath, (_backup(filepath) if os.path.exists(filepath) else None)
+            _make_writable(filepath)
+            os.replace(tmp_path, filepath)
+            done.append((filepath, backup))
+            current = backup = None
+    except Exception:
+        if current is not None:
+            # The failing target itself was left in place
+            if backup is not None:
+                _remove_backup(backup)
+            if os.path.exists(current):
+                _make_readonly(current)
+        for filepath, backup in reversed(done):
+            if backup is None:
+                _remove_quietly(filepath)
+                continue
             try:
-                os.remove(tmp_path)
+                os.replace(backup, filepath)
+                _make_readonly(filepath)
             except Exception:
+                pass # Best effort: the backup stays next to the file
+        for tmp_path in temps.values():
+            _remove_quietly(tmp_path)
+        raise
+    for filepath, backup in done:
+        if backup is not None:
+            _remove_backup(backup)
+    for filepath in temps:
+        _make_readonly(filepath)
+
+def read_source_bytes(filepath):
+    """
+    Reads a source file as raw bytes together with its stat result.
+    The stat is taken before reading so a concurrent write always makes the
+    cached mtime look stale rather than fresh.
+    """
+    st = os.stat(filepath)
+    with open(filepath, "rb") as f:
+        data = f.read()
+    return data, st
+
+def content_digest(data):
+    """Fast content fingerprint used to detect files whose mtime changed but content did not."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def decode_text(data, encoding="utf-8"):
+    """
+    Decodes raw bytes exactly like open(..., "r", encoding=encoding) would,
+    including universal newline translation.
+    """
+    text = data.decode(encoding)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+def scan_source_file(filepath, markers=(), chunk_size=1 << 20):
+    """
+    Streams a source file once to compute its content digest (same value as
+    content_digest) and which of the given byte markers occur in it, without
+    holding the whole file in memory. Returns (digest, found_markers, st); the
+    stat is taken before reading, as in read_source_bytes.
+    """
+    st = os.stat(filepath)
+    h = hashlib.blake2b(digest_size=16)
+    found = set()
+    overlap = max((len(m) for m in markers), default=1) - 1
+    tail = b""
+    with open(filepath, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+            if len(found) < len(markers):
+                # Keep the last few bytes so a marker split across two chunks is still seen
+                window = tail + chunk
+                found.update(m for m in markers if m in window)
+                tail = window[len(window) - overlap:] if overlap else b""
+    return h.hexdigest(), found, st
+
+def stat_by_directory(paths, max_workers=8):
+    """
+    Yields (path, st) for every path that exists. Paths are grouped by
+    directory and directories are validated in parallel, yielded as they
+    finish. On Windows each directory takes a single os.scandir pass whose
+    DirEntry stat results come with the listing, so no per-file syscall is
+    made; names the listing does not show (e.g. a different letter case)
+    fall back to os.stat. Missing files are skipped.
+    """
+    by_dir = {}
+    for path in paths:
+        directory, name = os.path.split(path)
+        by_dir.setdefault(directory, {})[name] = path
+
+    def scan(directory, names):
+        found = []
+        if SCANDIR_HAS_STAT and len(names) >= SCANDIR_MIN_FILES:
+            try:
+                with os.scandir(directory or os.curdir) as it:
+                    for entry in it:
+                        path = names.pop(entry.name, None)
+                        if path is None:
+                            continue
+                        try:
+                            found.append((path, entry.stat()))
+                        except OSError:
+                            pass
+            except OSError:
                 pass
-        raise e
+        for path in names.values():
+            try:
+                found.append((path, os.stat(path)))
+            except OSError:
+                pass
+        return found
+
+    if len(by_dir) <= 1:
+        for directory, names in by_dir.items():
+            yield from scan(directory, names)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(by_dir))) as executor:
+        futures = [executor.submit(scan, directory, names) for directory, names in by_dir.items()]
+        for future in concurrent.futures.as_completed(futures):
+            yield from future.result()
+
+def iter_source_lines(filepath, encoding="utf-8"):
+    """
+    Yields the decoded lines of a file one at a time, without line endings,
+    exactly as decode_text(...).split("\n") would produce them.
+    """
+    with open(filepath, "r", encoding=encoding) as f:
+        ended = True
+        for line in f:
+            ended = line.endswith("\n")
+            yield line[:-1] if ended else line
+        if ended:
+            yield ""